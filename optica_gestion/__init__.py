@@ -1 +1,7 @@
+from . import controllers
 from . import models
+from .models.indices import verificar_indices
+
+
+def post_init_hook(env):
+    verificar_indices(env)
@@ -1,6 +1,6 @@
 {
     'name': 'Gestión de Óptica',
-    'version': '19.0.2.0.0',
+    'version': '19.0.3.0.0',
     'category': 'Healthcare',
     'summary': 'Sistema de gestión de pacientes y consultas para ópticas',
     'description': """
@@ -14,11 +14,25 @@
     'depends': ['base', 'mail', 'calendar', 'contacts', 'account'],
     'data': [
         'security/ir.model.access.csv',
+        'security/optica_security.xml',
+        'data/ir_cron_data.xml',
+        'data/mail_activity_data.xml',
+        'report/receta_templates.xml',
+        'report/receta_reports.xml',
+        'views/dibujo_clinico_views.xml',
         'views/consulta_views.xml',
+        'views/progresion_views.xml',
+        'views/archivo_views.xml',
         'views/partner_views.xml',
+        'views/duplicado_views.xml',
         'views/cita_views.xml',
+        'views/horario_views.xml',
+        'views/importacion_fichas_views.xml',
+        'views/exportacion_views.xml',
+        'views/reporte_views.xml',
         'views/menu_views.xml',
     ],
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'application': True,
     'license': 'LGPL-3',
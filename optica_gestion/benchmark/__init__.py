@@ -0,0 +1,122 @@
+"""Benchmark de escala de optica_gestion contra una base PostgreSQL local.
+
+No se carga con el módulo; se lanza desde un shell de Odoo::
+
+    $ odoo-bin shell -d optica_bench
+    >>> from odoo.addons.optica_gestion.benchmark import ejecutar
+    >>> ejecutar(env, generar=True, escala=0.1)
+
+La primera ejecución con ``actualizar_baseline=True`` guarda tiempos y número
+de consultas SQL en ``baseline.json``; las siguientes fallan con
+:class:`RegresionBenchmark` si algún escenario empeora más de la tolerancia.
+"""
+import json
+import logging
+import os
+import statistics
+import time
+
+from .escenarios import ESCENARIOS
+from .generador import REF_BENCHMARK, generar_datos
+
+_logger = logging.getLogger(__name__)
+
+RUTA_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+class RegresionBenchmark(AssertionError):
+    pass
+
+
+class _Deshacer(Exception):
+    pass
+
+
+def _preparar_contexto(env):
+    env.cr.execute(
+        """
+        SELECT partner_id FROM optica_consulta
+      GROUP BY partner_id ORDER BY count(*) DESC LIMIT 1
+        """
+    )
+    row = env.cr.fetchone()
+    env.cr.execute(
+        "SELECT id FROM res_partner WHERE ref = %s ORDER BY id LIMIT 5000", [REF_BENCHMARK]
+    )
+    paciente_ids = [fila[0] for fila in env.cr.fetchall()]
+    if not paciente_ids:
+        raise RuntimeError(
+            "No hay pacientes del benchmark en la base: ejecutar con generar=True la primera vez"
+        )
+    return {
+        'paciente_id': row[0] if row else paciente_ids[0],
+        'paciente_ids': paciente_ids,
+        'optometrista_ids': env['res.users'].search([('login', '=like', 'optica-bench-%')]).ids,
+    }
+
+
+def _medir(env, funcion, contexto, deshacer):
+    """Ejecutar un escenario y devolver (segundos, consultas SQL)"""
+    env.invalidate_all()
+    consultas_inicio = env.cr.sql_log_count
+    inicio = time.perf_counter()
+    try:
+        with env.cr.savepoint():
+            funcion(env, contexto)
+            env.flush_all()
+            if deshacer:
+                raise _Deshacer()
+    except _Deshacer:
+        env.cr.precommit.clear()
+        env.invalidate_all()
+    return time.perf_counter() - inicio, env.cr.sql_log_count - consultas_inicio
+
+
+def ejecutar(env, generar=False, escala=1.0, repeticiones=5, tolerancia=0.25,
+             actualizar_baseline=False, ruta_baseline=RUTA_BASELINE):
+    """Ejecutar todos los escenarios y compararlos con la línea base
+
+    :param generar: generar antes los datos sintéticos (ver ``generador``)
+    :param escala: factor de volumen de los datos generados
+    :param repeticiones: repeticiones por escenario; se toma la mediana
+    :param tolerancia: empeoramiento relativo permitido antes de fallar
+    :param actualizar_baseline: guardar los resultados como nueva línea base
+    :return: diccionario ``{escenario: {'segundos', 'consultas'}}``
+    :raise RegresionBenchmark: si algún escenario supera la línea base
+    """
+    if generar:
+        generar_datos(env, escala=escala)
+    contexto = _preparar_contexto(env)
+
+    resultados = {}
+    for nombre, funcion, deshacer in ESCENARIOS:
+        medidas = [_medir(env, funcion, contexto, deshacer) for _i in range(repeticiones)]
+        resultados[nombre] = {
+            'segundos': round(statistics.median(segundos for segundos, _q in medidas), 4),
+            'consultas': max(consultas for _s, consultas in medidas),
+        }
+        _logger.info("Benchmark %s: %s", nombre, resultados[nombre])
+
+    if actualizar_baseline:
+        with open(ruta_baseline, 'w') as archivo:
+            json.dump(resultados, archivo, indent=4, sort_keys=True)
+        return resultados
+
+    if not os.path.exists(ruta_baseline):
+        _logger.warning("Benchmark: no hay línea base en %s", ruta_baseline)
+        return resultados
+    with open(ruta_baseline) as archivo:
+        baseline = json.load(archivo)
+    regresiones = []
+    for nombre, medida in resultados.items():
+        referencia = baseline.get(nombre)
+        if not referencia:
+            continue
+        for clave in ('segundos', 'consultas'):
+            if medida[clave] > referencia[clave] * (1 + tolerancia):
+                regresiones.append(
+                    f"{nombre}: {clave} {medida[clave]} > {referencia[clave]} (+{tolerancia:.0%})"
+                )
+    if regresiones:
+        raise RegresionBenchmark("Regresiones de rendimiento:\n" + "\n".join(regresiones))
+    return resultados
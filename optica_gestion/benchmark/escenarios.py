@@ -0,0 +1,80 @@
+"""Escenarios medidos por el benchmark.
+
+Cada escenario recibe ``(env, contexto)`` y ejecuta una operación clave de la
+clínica. Los que modifican datos se marcan con ``deshacer=True`` y el
+ejecutor revierte sus cambios al terminar cada repetición.
+"""
+from datetime import date, timedelta
+
+CAMPOS_LISTA_PACIENTES = [
+    'ficha_numero', 'name', 'edad', 'phone', 'ocupacion',
+    'ultima_consulta_fecha', 'consulta_count', 'blacklisted',
+]
+CAMPOS_LISTA_CONSULTAS = ['fecha_formateada', 'realizado_por', 'rx_observaciones']
+CAMPOS_AGENDA = [
+    'nombre', 'telefono', 'asignado_a', 'cantidad_personas', 'state',
+    'datetime_inicio', 'datetime_fin',
+]
+BUSQUEDAS = ['gar', 'marí', 'lópez j', '5123', 'F-000']
+
+
+def lista_pacientes(env, contexto):
+    env['res.partner'].search_read(
+        [('is_optica_patient', '=', True)], CAMPOS_LISTA_PACIENTES, limit=80
+    )
+
+
+def busqueda_pacientes(env, contexto):
+    for texto in BUSQUEDAS:
+        env['res.partner'].name_search(texto, [('is_optica_patient', '=', True)], limit=8)
+
+
+def formulario_paciente(env, contexto):
+    paciente = env['res.partner'].browse(contexto['paciente_id'])
+    paciente.read(list(env['res.partner']._fields))
+    paciente.consulta_ids.read(CAMPOS_LISTA_CONSULTAS)
+
+
+def agenda_semana(env, contexto):
+    lunes = date.today() - timedelta(days=date.today().weekday())
+    env['optica.cita'].search_read([
+        ('optometrista_id', 'in', contexto['optometrista_ids']),
+        ('datetime_inicio', '>=', lunes),
+        ('datetime_inicio', '<', lunes + timedelta(days=7)),
+    ], CAMPOS_AGENDA)
+
+
+def crear_citas_lote(env, contexto):
+    manana = date.today() + timedelta(days=365)
+    horarios = [key for key, _label in env['optica.cita'].HORARIOS][:-1]
+    env['optica.cita'].create([{
+        'nombre': f'Cita benchmark {numero}',
+        'fecha': manana + timedelta(days=numero // len(horarios)),
+        'hora_inicio': horarios[numero % len(horarios)],
+        'hora_fin': horarios[numero % len(horarios) + 1],
+        'optometrista_id': contexto['optometrista_ids'][0],
+    } for numero in range(500)])
+
+
+def transiciones_estado(env, contexto):
+    citas = env['optica.cita'].search(
+        [('state', '=', 'borrador')], limit=300, order='fecha, minuto_inicio'
+    )
+    citas.action_confirmar()
+    citas.action_cancelar()
+
+
+def recalculo_agregados(env, contexto):
+    env['res.partner'].browse(contexto['paciente_ids'])._actualizar_estadisticas_consultas()
+
+
+# (nombre, función, deshacer)
+ESCENARIOS = [
+    ('lista_pacientes', lista_pacientes, False),
+    ('busqueda_pacientes', busqueda_pacientes, False),
+    ('formulario_paciente', formulario_paciente, False),
+    ('agenda_semana', agenda_semana, False),
+    ('crear_citas_lote', crear_citas_lote, True),
+    ('transiciones_estado', transiciones_estado, True),
+    ('recalculo_agregados', recalculo_agregados, True),
+]
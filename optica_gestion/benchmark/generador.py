@@ -0,0 +1,195 @@
+"""Generador de datos sintéticos de una clínica para los benchmarks.
+
+Los volúmenes por defecto (``escala=1``) son 100k pacientes, 1M consultas,
+500k citas con su evento de calendario y 20k dibujos clínicos. Todo se crea
+por el ORM en lotes confirmados, con el tracking desactivado y las
+estadísticas de pacientes diferidas, como haría una carga masiva real.
+"""
+import base64
+import io
+import logging
+import random
+from datetime import date, timedelta
+
+from PIL import Image
+
+_logger = logging.getLogger(__name__)
+
+VOLUMENES = {
+    'pacientes': 100_000,
+    'consultas': 1_000_000,
+    'citas': 500_000,
+    'dibujos': 20_000,
+}
+OPTOMETRISTAS = 20
+TAMANO_LOTE = 2000
+REF_BENCHMARK = 'optica-benchmark'
+
+NOMBRES = [
+    'María', 'José', 'Juan', 'Ana', 'Luis', 'Carmen', 'Carlos', 'Rosa', 'Jorge',
+    'Marta', 'Pedro', 'Lucía', 'Miguel', 'Sofía', 'Diego', 'Elena', 'Andrés',
+    'Paula', 'Fernando', 'Gabriela', 'Ricardo', 'Claudia', 'Héctor', 'Silvia',
+]
+APELLIDOS = [
+    'García', 'López', 'Pérez', 'González', 'Rodríguez', 'Hernández', 'Martínez',
+    'Morales', 'Castillo', 'Ramírez', 'Flores', 'Méndez', 'Estrada', 'Orellana',
+    'Barrios', 'Juárez', 'Cifuentes', 'Aguilar', 'Monterroso', 'Velásquez',
+]
+SINTOMAS = (
+    'cefalea', 'vision_borrosa', 'dolor', 'ojo_rojo', 'fotofobia', 'glaucoma',
+    'diabetes', 'secreciones', 'cansancio', 'volantes', 'ardor', 'embarazo',
+    'presion', 'cx', 'otros',
+)
+
+
+def _graduacion(rng, minimo, maximo, paso=0.25):
+    valor = round(rng.randint(int(minimo / paso), int(maximo / paso)) * paso, 2)
+    return f'{valor:+.2f}'
+
+
+def _imagen_plantilla():
+    """Plantilla de dibujo que se repite, como las que suben las clínicas"""
+    imagen = Image.new('RGB', (800, 400), 'white')
+    salida = io.BytesIO()
+    imagen.save(salida, format='PNG')
+    return base64.b64encode(salida.getvalue())
+
+
+def _en_lotes(env, total, crear):
+    """Llamar ``crear(inicio, cantidad)`` por lotes, confirmando cada uno"""
+    for inicio in range(0, total, TAMANO_LOTE):
+        crear(inicio, min(TAMANO_LOTE, total - inicio))
+        env.cr.commit()
+        env.invalidate_all()
+        _logger.info("Benchmark: %s/%s", min(inicio + TAMANO_LOTE, total), total)
+
+
+def generar_datos(env, escala=1.0, semilla=42):
+    """Generar la clínica sintética; no hace nada si ya existe
+
+    :return: diccionario con los ids de optometristas generados
+    """
+    rng = random.Random(semilla)
+    volumen = {clave: max(int(valor * escala), 1) for clave, valor in VOLUMENES.items()}
+    env = env(context=dict(
+        env.context,
+        tracking_disable=True,
+        mail_create_nolog=True,
+        mail_notrack=True,
+        optica_diferir_estadisticas=True,
+    ))
+    Partner = env['res.partner']
+
+    optometristas = env['res.users'].search([('login', '=like', 'optica-bench-%')])
+    if not optometristas:
+        optometristas = env['res.users'].create([{
+            'name': f'Optometrista {numero + 1}',
+            'login': f'optica-bench-{numero + 1}',
+            'tz': 'America/Guatemala',
+        } for numero in range(OPTOMETRISTAS)])
+        env.cr.commit()
+
+    if Partner.search_count([('ref', '=', REF_BENCHMARK)], limit=1):
+        _logger.info("Benchmark: los datos sintéticos ya existen")
+        return {'optometrista_ids': optometristas.ids}
+
+    hoy = date.today()
+
+    def crear_pacientes(_inicio, cantidad):
+        vals_list = []
+        for _i in range(cantidad):
+            vals = {
+                'name': f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}',
+                'phone': f'{rng.choice("3456")}{rng.randint(0, 9999999):07d}',
+                'is_optica_patient': True,
+                'ref': REF_BENCHMARK,
+                'edad': rng.randint(5, 90),
+                'fecha': hoy - timedelta(days=rng.randint(0, 3650)),
+                'blacklisted': rng.random() < 0.01,
+                'lentes': rng.random() < 0.5,
+            }
+            vals.update({sintoma: rng.random() < 0.1 for sintoma in SINTOMAS})
+            vals_list.append(vals)
+        Partner.create(vals_list)
+
+    _en_lotes(env, volumen['pacientes'], crear_pacientes)
+    env.cr.execute(
+        "SELECT id FROM res_partner WHERE ref = %s ORDER BY id", [REF_BENCHMARK]
+    )
+    paciente_ids = [row[0] for row in env.cr.fetchall()]
+
+    def crear_consultas(_inicio, cantidad):
+        vals_list = []
+        for _i in range(cantidad):
+            vals = {
+                'partner_id': rng.choice(paciente_ids),
+                'fecha': hoy - timedelta(days=rng.randint(0, 3650)),
+                'edad_consulta': rng.randint(5, 90),
+                'realizado_por': rng.choice(NOMBRES),
+                'tipo_lente': rng.choice(['monofocal', 'bifocal', 'progresivo', 'ocupacional', 'contacto']),
+                'material_lente': rng.choice(['cr39', 'policarbonato', 'alto_indice', 'trivex', 'cristal']),
+                'tratamientos_lente': rng.choice(['antireflejo', 'fotocromatico', 'blue_block', 'transitions', 'polarizado']),
+                'presion_od': rng.uniform(10, 24),
+                'presion_oi': rng.uniform(10, 24),
+                'dip_total': rng.uniform(54, 72),
+            }
+            for prefijo in ('lens', 'ret', 'rx'):
+                for ojo in ('od', 'oi'):
+                    vals[f'{prefijo}_{ojo}_esfera'] = _graduacion(rng, -10, 6)
+                    vals[f'{prefijo}_{ojo}_cilindro'] = _graduacion(rng, -4, 0)
+                    vals[f'{prefijo}_{ojo}_eje'] = str(rng.randint(0, 180))
+                    if prefijo != 'ret':
+                        vals[f'{prefijo}_{ojo}_add'] = _graduacion(rng, 0, 3)
+            vals_list.append(vals)
+        env['optica.consulta'].create(vals_list)
+
+    _en_lotes(env, volumen['consultas'], crear_consultas)
+
+    # Citas de 30 minutos sin solapamiento: cada optometrista llena su día
+    # de forma consecutiva, hacia atrás desde dentro de dos meses
+    Cita = env['optica.cita']
+    horarios = [key for key, _label in Cita.HORARIOS][:-2:2]
+    por_dia = len(horarios) * len(optometristas)
+    inicio_agenda = hoy + timedelta(days=60)
+
+    def crear_citas(inicio, cantidad):
+        vals_list = []
+        for posicion in range(inicio, inicio + cantidad):
+            dia, resto = divmod(posicion, por_dia)
+            optometrista, slot = divmod(resto, len(horarios))
+            fecha = inicio_agenda - timedelta(days=dia)
+            hora_inicio = horarios[slot]
+            if fecha > hoy:
+                state = rng.choice(['borrador', 'confirmada'])
+            else:
+                state = rng.choices(['completada', 'cancelada', 'no_asistio'], [80, 10, 10])[0]
+            vals_list.append({
+                'nombre': f'{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)}',
+                'telefono': f'5{rng.randint(0, 9999999):07d}',
+                'fecha': fecha,
+                'hora_inicio': hora_inicio,
+                'hora_fin': Cita.MINUTO_SLOT[Cita.SLOT_MINUTOS[hora_inicio] + 30],
+                'optometrista_id': optometristas[optometrista].id,
+                'cantidad_personas': rng.choice([1, 1, 1, 2, 3]),
+                'state': state,
+            })
+        Cita.create(vals_list)
+
+    _en_lotes(env, volumen['citas'], crear_citas)
+
+    imagen = _imagen_plantilla()
+    env.cr.execute(
+        "SELECT id FROM optica_consulta ORDER BY id DESC LIMIT %s", [volumen['dibujos']]
+    )
+    consulta_ids = [row[0] for row in env.cr.fetchall()]
+
+    def crear_dibujos(inicio, cantidad):
+        env['optica.dibujo.clinico'].create([{
+            'consulta_id': consulta_id,
+            'nombre': 'Fondo de ojo',
+            'tipo': rng.choice(['ojo_derecho', 'ojo_izquierdo', 'ambos']),
+            'imagen': imagen,
+        } for consulta_id in consulta_ids[inicio:inicio + cantidad]])
+
+    _en_lotes(env, len(consulta_ids), crear_dibujos)
+    return {'optometrista_ids': optometristas.ids}
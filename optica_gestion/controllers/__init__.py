@@ -0,0 +1,4 @@
+from . import agenda
+from . import receta
+from . import sincronizacion
+from . import exportacion
@@ -0,0 +1,29 @@
+from odoo import fields, http
+from odoo.http import request
+from ..models.agenda import leer_agenda
+from datetime import timedelta
+
+
+class OpticaAgendaController(http.Controller):
+
+    @http.route('/optica/agenda', type='http', auth='user', methods=['GET'], readonly=True)
+    def agenda(self, fecha=None, dias='1', optometristas='', **kwargs):
+        """Agenda de solo lectura para pantallas de sala de espera y recepción
+
+        :param fecha: primer día (YYYY-MM-DD), hoy por defecto
+        :param dias: número de días (1 a 7)
+        :param optometristas: ids de ``res.users`` separados por comas
+        """
+        request.env['optica.cita'].check_access('read')
+        try:
+            desde = fields.Date.to_date(fecha) if fecha else fields.Date.context_today(request.env.user)
+            hasta = desde + timedelta(days=min(max(int(dias), 1), 7) - 1)
+            optometrista_ids = tuple(sorted(int(oid) for oid in optometristas.split(',') if oid.strip()))
+        except ValueError:
+            return request.make_json_response({'error': "Parámetros de agenda no válidos"}, status=400)
+        etag, datos = leer_agenda(request.env, desde, hasta, optometrista_ids)
+
+        headers = [('ETag', etag), ('Cache-Control', 'private, no-cache')]
+        if request.httprequest.headers.get('If-None-Match') == etag:
+            return request.make_response('', headers=headers, status=304)
+        return request.make_json_response(datos, headers=headers)
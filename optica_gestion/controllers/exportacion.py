@@ -0,0 +1,31 @@
+from odoo import http
+from odoo.http import request, Stream
+import os
+
+TIPOS_CONTENIDO = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class OpticaExportacionController(http.Controller):
+
+    @http.route('/optica/exportacion/<int:exportacion_id>', type='http', auth='user', methods=['GET'])
+    def descargar(self, exportacion_id, **kwargs):
+        """Archivo de una exportación terminada, enviado por streaming desde el disco"""
+        exportacion = request.env['optica.exportacion'].browse(exportacion_id).exists()
+        if not exportacion:
+            raise request.not_found()
+        exportacion.check_access('read')
+        ruta = exportacion._ruta_archivo()
+        if exportacion.state != 'hecho' or not os.path.exists(ruta):
+            raise request.not_found()
+        stream = Stream(
+            type='path',
+            path=ruta,
+            mimetype=TIPOS_CONTENIDO[exportacion.formato],
+            download_name=exportacion.archivo_nombre,
+            size=os.path.getsize(ruta),
+            last_modified=os.path.getmtime(ruta),
+        )
+        return stream.get_response(as_attachment=True)
@@ -0,0 +1,34 @@
+from odoo import http
+from odoo.http import request, content_disposition
+from werkzeug.wsgi import wrap_file
+import re
+import tempfile
+import zipfile
+
+
+class OpticaRecetaController(http.Controller):
+
+    @http.route('/optica/recetas/zip', type='http', auth='user', methods=['GET'])
+    def recetas_zip(self, ids='', **kwargs):
+        """ZIP con la receta de cada consulta, escrito a un archivo temporal por
+        lotes y enviado por streaming sin cargarlo completo en memoria"""
+        consulta_ids = [int(consulta_id) for consulta_id in ids.split(',') if consulta_id.strip()]
+        consultas = request.env['optica.consulta'].browse(consulta_ids).exists()
+        consultas.check_access('read')
+
+        archivo = tempfile.TemporaryFile()
+        with zipfile.ZipFile(archivo, 'w', zipfile.ZIP_DEFLATED) as zip_recetas:
+            for consulta, stream in consultas._iterar_recetas_pdf():
+                nombre = re.sub(r'[^\w\- ]', '', f'{consulta.partner_id.name} {consulta.fecha}')
+                zip_recetas.writestr(f'{nombre} ({consulta.id}).pdf', stream.getvalue())
+        tamano = archivo.tell()
+        archivo.seek(0)
+        return http.Response(
+            wrap_file(request.httprequest.environ, archivo),
+            headers=[
+                ('Content-Type', 'application/zip'),
+                ('Content-Length', tamano),
+                ('Content-Disposition', content_disposition('recetas.zip')),
+            ],
+            direct_passthrough=True,
+        )
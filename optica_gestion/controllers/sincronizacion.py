@@ -0,0 +1,299 @@
+from odoo import fields, http
+from odoo.http import request
+from odoo.tools import json_default
+from ..models.sync_baja import RETENCION_BAJAS
+from datetime import datetime, timedelta
+import base64
+import gzip
+import json
+
+# Filas máximas por modelo en cada pull y consultas máximas por push
+LIMITE_PULL = 500
+MAX_LIMITE_PULL = 2000
+MAX_LOTE_PUSH = 200
+
+# Los cambios más recientes que este margen se entregan en el pull siguiente,
+# para no saltarse transacciones que escribieron antes pero confirmaron después
+MARGEN_CURSOR = timedelta(seconds=30)
+
+# Respuestas más pequeñas que esto se envían sin comprimir
+MIN_GZIP = 1024
+
+# write_date con microsegundos: versión de cada registro para detectar conflictos
+FORMATO_VERSION = 'YYYY-MM-DD HH24:MI:SS.US'
+CURSOR_INICIAL = ['1970-01-01 00:00:00.000000', 0]
+
+CAMPOS_PACIENTE = (
+    'name', 'phone', 'email', 'ficha_numero', 'edad', 'fecha', 'ocupacion',
+    'direccion_paciente', 'blacklisted', 'active',
+)
+CAMPOS_CITA = (
+    'nombre', 'partner_id', 'telefono', 'fecha', 'hora_inicio', 'hora_fin',
+    'minuto_inicio', 'minuto_fin', 'state', 'optometrista_id', 'cantidad_personas', 'notas',
+)
+
+# Tipos de campo de consulta que viajan en la sincronización
+TIPOS_SINCRONIZADOS = {'char', 'text', 'float', 'integer', 'boolean', 'date', 'selection', 'many2one'}
+
+
+def _campos_consulta(Consulta):
+    """Campos editables y almacenados de la consulta (sin calculados ni columnas de log)"""
+    return [
+        nombre for nombre, campo in Consulta._fields.items()
+        if campo.store and not campo.compute and not campo.readonly
+        and campo.type in TIPOS_SINCRONIZADOS
+    ]
+
+
+def _posicion_valida(posicion):
+    """Si ``posicion`` tiene la forma ``[version, id]`` que escribe el pull"""
+    if not (isinstance(posicion, list) and len(posicion) == 2 and isinstance(posicion[1], int)):
+        return False
+    try:
+        datetime.fromisoformat(posicion[0])
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+class OpticaSincronizacionController(http.Controller):
+    """API JSON de sincronización incremental para las tabletas de consulta
+
+    El pull entrega pacientes, consultas y las citas del día modificados
+    desde un cursor opaco, y los ids que la tableta debe borrar; el push guarda consultas nuevas o editadas por
+    lotes y rechaza las que cambiaron en el servidor desde la versión que
+    tenía la tableta. Las respuestas se comprimen con gzip si el cliente lo
+    acepta, y el push admite cuerpos comprimidos.
+    """
+
+    # ==================== PULL ====================
+    @http.route('/optica/sync/pull', type='http', auth='user', methods=['GET'], readonly=True)
+    def pull(self, cursor=None, fecha=None, limite=None, **kwargs):
+        """Cambios desde ``cursor``
+
+        :param cursor: cursor devuelto por el pull anterior (vacío la primera vez)
+        :param fecha: día de las citas (YYYY-MM-DD), hoy por defecto
+        :param limite: filas máximas por modelo
+        :return: ``{cursor, completo, pacientes, consultas, citas, bajas}``;
+            ``bajas`` trae por modelo los ids a borrar (eliminados, archivados
+            o que dejaron de ser pacientes). Si ``completo`` es falso quedan
+            cambios y se debe volver a pedir. Si el cursor es más antiguo que
+            las bajas guardadas se responde solo ``{reiniciar: true}`` y la
+            tableta debe borrar sus datos y empezar sin cursor.
+        """
+        env = request.env
+        try:
+            posiciones = json.loads(base64.urlsafe_b64decode(cursor)) if cursor else {}
+            if not isinstance(posiciones, dict) or not all(
+                _posicion_valida(posicion) for clave, posicion in posiciones.items() if clave != 'dia'
+            ):
+                raise ValueError("cursor no válido")
+            dia = fields.Date.to_date(fecha) if fecha else fields.Date.context_today(env.user)
+            limite = min(max(int(limite or LIMITE_PULL), 1), MAX_LIMITE_PULL)
+        except ValueError:
+            return self._respuesta({'error': "Parámetros de sincronización no válidos"}, status=400)
+        ahora = env.cr.now()
+        tope = ahora - MARGEN_CURSOR
+        posicion_tope = [tope.strftime('%Y-%m-%d %H:%M:%S.%f'), 0]
+        retencion = (ahora - timedelta(days=RETENCION_BAJAS)).strftime('%Y-%m-%d %H:%M:%S.%f')
+        if any(
+            posicion != CURSOR_INICIAL and posicion[0] < retencion
+            for clave, posicion in posiciones.items() if clave.startswith('bajas_')
+        ):
+            return self._respuesta({'reiniciar': True})
+        dia_texto = fields.Date.to_string(dia)
+        if not cursor:
+            # Una tableta sin datos no tiene nada que borrar
+            for clave in ('pacientes', 'consultas', 'citas'):
+                posiciones[f'bajas_{clave}'] = posicion_tope
+        elif posiciones.get('dia') != dia_texto:
+            # Las citas del día nuevo se descargan completas
+            posiciones['citas'] = CURSOR_INICIAL
+            posiciones['bajas_citas'] = posicion_tope
+
+        Consulta = env['optica.consulta']
+        fuentes = [
+            ('pacientes', env['res.partner'], list(CAMPOS_PACIENTE), "is_optica_patient", []),
+            ('consultas', Consulta, _campos_consulta(Consulta), "TRUE", []),
+            ('citas', env['optica.cita'], list(CAMPOS_CITA), "fecha = %s", [dia]),
+        ]
+        datos = {'completo': True, 'bajas': {}}
+        for clave, modelo, campos, condicion, params in fuentes:
+            modelo.check_access('read')
+            filas = self._cambios(modelo, condicion, params, posiciones.get(clave) or CURSOR_INICIAL, tope, limite)
+            if filas:
+                posiciones[clave] = list(filas[-1])
+            if len(filas) == limite:
+                datos['completo'] = False
+            datos[clave] = self._leer(modelo, campos, filas)
+
+            clave_bajas = f'bajas_{clave}'
+            bajas = self._bajas(modelo, condicion, params, posiciones.get(clave_bajas) or CURSOR_INICIAL, tope, limite)
+            if len(bajas) == limite:
+                datos['completo'] = False
+                posiciones[clave_bajas] = [bajas[-1][0], bajas[-1][1]]
+            else:
+                posiciones[clave_bajas] = posicion_tope
+            datos['bajas'][clave] = sorted({registro_id for _version, _id, registro_id, vigente in bajas if not vigente})
+        posiciones['dia'] = dia_texto
+        datos['cursor'] = base64.urlsafe_b64encode(json.dumps(posiciones).encode()).decode()
+        return self._respuesta(datos)
+
+    def _cambios(self, modelo, condicion, params, posicion, tope, limite):
+        """``[(version, id)]`` de los registros modificados después de ``posicion``, en orden"""
+        request.env.cr.execute(
+            f"""
+            SELECT to_char(write_date, %s), id
+              FROM "{modelo._table}"
+             WHERE {condicion}
+               AND write_date <= %s
+               AND (write_date, id) > (%s::timestamp, %s)
+          ORDER BY write_date, id
+             LIMIT %s
+            """,
+            [FORMATO_VERSION, *params, tope, posicion[0], posicion[1], limite]
+        )
+        return request.env.cr.fetchall()
+
+    def _bajas(self, modelo, condicion, params, posicion, tope, limite):
+        """``[(version, id, registro_id, vigente)]`` de las bajas de ``modelo`` después de ``posicion``
+
+        ``vigente`` indica que el registro vuelve a cumplir ``condicion`` (por
+        ejemplo, un contacto que volvió a ser paciente): no se borra, llega
+        como cambio.
+        """
+        request.env.cr.execute(
+            f"""
+            SELECT to_char(b.create_date, %s), b.id, b.registro_id,
+                   EXISTS (SELECT 1 FROM "{modelo._table}" WHERE id = b.registro_id AND {condicion})
+              FROM optica_sync_baja b
+             WHERE b.tabla = %s
+               AND b.create_date <= %s
+               AND (b.create_date, b.id) > (%s::timestamp, %s)
+          ORDER BY b.create_date, b.id
+             LIMIT %s
+            """,
+            [FORMATO_VERSION, *params, modelo._table, tope, posicion[0], posicion[1], limite]
+        )
+        return request.env.cr.fetchall()
+
+    def _leer(self, modelo, campos, filas):
+        """Valores de los registros con acceso de lectura, con su versión"""
+        versiones = {registro_id: version for version, registro_id in filas}
+        registros = modelo.with_context(active_test=False).browse(list(versiones))._filtered_access('read')
+        valores = registros.read(campos, load=None)
+        for registro in valores:
+            registro['version'] = versiones[registro['id']]
+        return valores
+
+    # ==================== PUSH ====================
+    @http.route('/optica/sync/push', type='http', auth='user', methods=['POST'], csrf=False)
+    def push(self, **kwargs):
+        """Guardar un lote de consultas
+
+        Cuerpo (``Content-Type: application/json``):
+        ``{"consultas": [{"ref", "id", "version", "valores"}]}``. Sin
+        ``id`` la consulta se crea; con ``id`` se actualiza solo si su versión
+        en el servidor sigue siendo ``version``, y si no se devuelve como
+        conflicto con los valores actuales del servidor.
+
+        :return: ``{guardadas: [{ref, id, version}], conflictos: [{ref, id, servidor}],
+            errores: [{ref, error}]}``
+        """
+        env = request.env
+        # La ruta usa la cookie de sesión sin token CSRF: exigir JSON obliga al
+        # navegador a hacer una petición previa CORS, que una página de otro
+        # sitio no supera, en lugar de un simple POST de formulario
+        if request.httprequest.mimetype != 'application/json':
+            return self._respuesta({'error': "El cuerpo debe enviarse como application/json"}, status=415)
+        try:
+            cuerpo = request.httprequest.get_data()
+            if request.httprequest.headers.get('Content-Encoding') == 'gzip':
+                cuerpo = gzip.decompress(cuerpo)
+            items = json.loads(cuerpo).get('consultas') or []
+            for item in items:
+                item['id'] = int(item['id']) if item.get('id') else False
+        except (OSError, ValueError, TypeError, AttributeError):
+            return self._respuesta({'error': "Cuerpo JSON no válido"}, status=400)
+        if len(items) > MAX_LOTE_PUSH:
+            return self._respuesta({'error': "Máximo %s consultas por lote" % MAX_LOTE_PUSH}, status=413)
+
+        Consulta = env['optica.consulta']
+        campos = _campos_consulta(Consulta)
+        resultado = {'guardadas': [], 'conflictos': [], 'errores': []}
+        nuevas, existentes = [], []
+        for item in items:
+            valores = {campo: valor for campo, valor in (item.get('valores') or {}).items() if campo in campos}
+            (existentes if item['id'] else nuevas).append((item, valores))
+
+        # Bloquear las consultas editadas y comparar versiones antes de escribir
+        versiones = {}
+        if existentes:
+            env.cr.execute(
+                "SELECT id, to_char(write_date, %s) FROM optica_consulta WHERE id = ANY(%s) FOR UPDATE",
+                [FORMATO_VERSION, [item['id'] for item, _valores in existentes]]
+            )
+            versiones = dict(env.cr.fetchall())
+        guardadas = []
+        for item, valores in existentes:
+            consulta_id = item['id']
+            if consulta_id not in versiones:
+                resultado['errores'].append({'ref': item.get('ref'), 'error': "La consulta ya no existe"})
+            elif versiones[consulta_id] != item.get('version'):
+                resultado['conflictos'].append({'ref': item.get('ref'), 'id': consulta_id})
+            else:
+                try:
+                    with env.cr.savepoint():
+                        Consulta.browse(consulta_id).write(valores)
+                    guardadas.append((item.get('ref'), consulta_id))
+                except Exception as e:
+                    resultado['errores'].append({'ref': item.get('ref'), 'error': str(e)})
+
+        if nuevas:
+            try:
+                with env.cr.savepoint():
+                    creadas = Consulta.create([valores for _item, valores in nuevas])
+                guardadas += [
+                    (item.get('ref'), consulta_id) for (item, _valores), consulta_id in zip(nuevas, creadas.ids)
+                ]
+            except Exception:
+                # Aislar las consultas problemáticas creándolas una a una
+                for item, valores in nuevas:
+                    try:
+                        with env.cr.savepoint():
+                            guardadas.append((item.get('ref'), Consulta.create(valores).id))
+                    except Exception as e:
+                        resultado['errores'].append({'ref': item.get('ref'), 'error': str(e)})
+
+        # Versiones nuevas de lo guardado y valores del servidor de los conflictos
+        env.flush_all()
+        consulta_ids = [consulta_id for _ref, consulta_id in guardadas]
+        consulta_ids += [conflicto['id'] for conflicto in resultado['conflictos']]
+        if consulta_ids:
+            env.cr.execute(
+                "SELECT id, to_char(write_date, %s) FROM optica_consulta WHERE id = ANY(%s)",
+                [FORMATO_VERSION, consulta_ids]
+            )
+            versiones = dict(env.cr.fetchall())
+            resultado['guardadas'] = [
+                {'ref': ref, 'id': consulta_id, 'version': versiones[consulta_id]}
+                for ref, consulta_id in guardadas
+            ]
+            if resultado['conflictos']:
+                servidor = self._leer(Consulta, campos, [
+                    (versiones[conflicto['id']], conflicto['id']) for conflicto in resultado['conflictos']
+                ])
+                por_id = {registro['id']: registro for registro in servidor}
+                for conflicto in resultado['conflictos']:
+                    conflicto['servidor'] = por_id.get(conflicto['id'])
+        return self._respuesta(resultado)
+
+    # ==================== RESPUESTA ====================
+    def _respuesta(self, datos, status=200):
+        """Respuesta JSON, comprimida con gzip si el cliente lo acepta"""
+        cuerpo = json.dumps(datos, ensure_ascii=False, default=json_default, separators=(',', ':')).encode()
+        headers = [('Content-Type', 'application/json; charset=utf-8'), ('Vary', 'Accept-Encoding')]
+        if len(cuerpo) >= MIN_GZIP and 'gzip' in request.httprequest.headers.get('Accept-Encoding', ''):
+            cuerpo = gzip.compress(cuerpo, compresslevel=6)
+            headers.append(('Content-Encoding', 'gzip'))
+        return request.make_response(cuerpo, headers=headers, status=status)
@@ -0,0 +1,68 @@
+import logging
+
+from odoo.addons.optica_gestion.models.ficha_clinica import CAMPOS_FICHA_BOOLEANOS, CAMPOS_FICHA_TEXTO
+from odoo.tools.sql import column_exists
+
+_logger = logging.getLogger(__name__)
+
+# Columnas del cuestionario que pasan de res_partner a optica_ficha_clinica
+COLUMNAS_BOOLEANAS = CAMPOS_FICHA_BOOLEANOS
+COLUMNAS_TEXTO = CAMPOS_FICHA_TEXTO
+
+TAMANO_TRAMO = 20000
+
+
+def migrate(cr, version):
+    """Copiar el cuestionario de cada contacto a su ficha clínica y quitar las columnas
+
+    Se recorre res_partner por tramos de id; solo reciben ficha los pacientes
+    y los contactos con algún dato del cuestionario. Cada tramo es
+    idempotente (ON CONFLICT), así que la migración puede repetirse.
+    """
+    columnas = [
+        columna for columna in COLUMNAS_BOOLEANAS + COLUMNAS_TEXTO
+        if column_exists(cr, 'res_partner', columna)
+    ]
+    if not columnas:
+        return
+    lista = ', '.join(f'"{columna}"' for columna in columnas)
+    valores = ', '.join(f'p."{columna}"' for columna in columnas)
+    con_datos = ' OR '.join(
+        f'p."{columna}"' if columna in COLUMNAS_BOOLEANAS else f"btrim(p.\"{columna}\") <> ''"
+        for columna in columnas
+    )
+
+    cr.execute("SELECT min(id), max(id) FROM res_partner")
+    minimo, maximo = cr.fetchone()
+    total = 0
+    for inicio in range(minimo or 0, (maximo or -1) + 1, TAMANO_TRAMO):
+        cr.execute(
+            f"""
+            INSERT INTO optica_ficha_clinica (partner_id, {lista},
+                                              create_uid, create_date, write_uid, write_date)
+            SELECT p.id, {valores},
+                   1, now() at time zone 'UTC', 1, now() at time zone 'UTC'
+              FROM res_partner p
+             WHERE p.id >= %s AND p.id < %s
+               AND (p.is_optica_patient OR {con_datos})
+            ON CONFLICT (partner_id) DO NOTHING
+            """,
+            [inicio, inicio + TAMANO_TRAMO]
+        )
+        total += cr.rowcount
+        cr.execute(
+            """
+            UPDATE res_partner p
+               SET ficha_clinica_id = f.id
+              FROM optica_ficha_clinica f
+             WHERE f.partner_id = p.id
+               AND p.id >= %s AND p.id < %s
+               AND p.ficha_clinica_id IS NULL
+            """,
+            [inicio, inicio + TAMANO_TRAMO]
+        )
+
+    quitar = ', '.join(f'DROP COLUMN "{columna}"' for columna in columnas)
+    cr.execute(f"ALTER TABLE res_partner {quitar}")
+    _logger.info("Fichas clínicas: %s fichas creadas desde res_partner, %s columnas eliminadas",
+                 total, len(columnas))
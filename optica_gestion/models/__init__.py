@@ -1,4 +1,16 @@
+from . import indices
+from . import tracking_lote
+from . import reporte
+from . import ficha_clinica
 from . import partner
 from . import consulta
+from . import progresion
+from . import horario
 from . import cita
+from . import cita_sync
+from . import sync_baja
 from . import dibujo_clinico
+from . import archivo
+from . import duplicado
+from . import importacion_fichas
+from . import exportacion
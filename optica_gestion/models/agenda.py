@@ -0,0 +1,114 @@
+from odoo import fields
+from odoo.tools import SQL
+import hashlib
+import threading
+import time
+
+# Segundos durante los que una respuesta en caché se sirve sin tocar la base de datos
+TTL_CACHE = 2
+MAX_ENTRADAS_CACHE = 256
+
+# Columnas de optica.cita que usan las pantallas de agenda
+COLUMNAS_AGENDA = (
+    'id', 'nombre', 'fecha', 'hora_inicio', 'hora_fin', 'minuto_inicio', 'minuto_fin',
+    'datetime_inicio', 'datetime_fin', 'state', 'cantidad_personas', 'asignado_a', 'optometrista_id',
+)
+
+# (dbname, uid, compañías, desde, hasta, optometristas) -> (etag, datos, verificado)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def invalidar_cache_agenda(env):
+    """Vaciar la caché de agenda de la base de datos cuando se confirme la transacción
+
+    Vaciarla antes del commit permitiría que otra petición la volviera a
+    llenar con datos que todavía no incluyen los cambios.
+    """
+    postcommit = env.cr.postcommit
+    if 'optica.agenda.cache' in postcommit.data:
+        return
+    postcommit.data['optica.agenda.cache'] = True
+    dbname = env.cr.dbname
+
+    @postcommit.add
+    def vaciar_cache():
+        with _cache_lock:
+            for clave in [clave for clave in _cache if clave[0] == dbname]:
+                del _cache[clave]
+
+
+def leer_agenda(env, desde, hasta, optometrista_ids):
+    """``(etag, datos)`` de la agenda del rango, desde la caché si sigue vigente
+
+    La caché es por usuario y compañías, porque las citas se leen aplicando
+    sus reglas de acceso. Pasado ``TTL_CACHE`` se recalcula la firma del
+    rango y los datos solo se vuelven a leer si cambió.
+    """
+    clave = (env.cr.dbname, env.uid, tuple(env.companies.ids), desde, hasta, optometrista_ids)
+    with _cache_lock:
+        entrada = _cache.get(clave)
+    if entrada and time.monotonic() - entrada[2] < TTL_CACHE:
+        return entrada[0], entrada[1]
+
+    Cita = env['optica.cita']
+    dominio = [('fecha', '>=', desde), ('fecha', '<=', hasta)]
+    if optometrista_ids:
+        dominio.append(('optometrista_id', 'in', list(optometrista_ids)))
+    etag = _calcular_etag(Cita, dominio, clave)
+    if entrada and entrada[0] == etag:
+        datos = entrada[1]
+    else:
+        datos = _leer_citas(Cita, dominio, desde, hasta)
+    with _cache_lock:
+        if len(_cache) >= MAX_ENTRADAS_CACHE:
+            _cache.clear()
+        _cache[clave] = (etag, datos, time.monotonic())
+    return etag, datos
+
+
+def _calcular_etag(Cita, dominio, clave):
+    """ETag a partir del id y write_date de cada cita del rango
+
+    Un resumen de todas las versiones (y no solo el último write_date)
+    detecta también las transacciones que escribieron antes pero
+    confirmaron después de la última lectura.
+    """
+    query = Cita._search(dominio)
+    id_cita = SQL.identifier(Cita._table, 'id')
+    Cita.env.cr.execute(query.select(SQL(
+        "count(*), md5(string_agg(%s::text || '@' || %s::text, ',' ORDER BY %s))",
+        id_cita, SQL.identifier(Cita._table, 'write_date'), id_cita,
+    )))
+    total, resumen = Cita.env.cr.fetchone()
+    firma = f'{clave}|{total}|{resumen}'.encode()
+    return '"%s"' % hashlib.sha1(firma).hexdigest()
+
+
+def _leer_citas(Cita, dominio, desde, hasta):
+    """Citas del rango con solo los campos que usan las pantallas, en una consulta"""
+    query = Cita._search(dominio, order='fecha, minuto_inicio, id')
+    Cita.env.cr.execute(query.select(*(SQL.identifier(Cita._table, columna) for columna in COLUMNAS_AGENDA)))
+    filas = [dict(zip(COLUMNAS_AGENDA, fila)) for fila in Cita.env.cr.fetchall()]
+    optometristas = Cita.env['res.users'].browse({fila['optometrista_id'] for fila in filas} - {None})
+    nombres = {usuario.id: usuario.name for usuario in optometristas}
+    return {
+        'desde': fields.Date.to_string(desde),
+        'hasta': fields.Date.to_string(hasta),
+        'citas': [{
+            'id': fila['id'],
+            'nombre': fila['nombre'],
+            'fecha': fields.Date.to_string(fila['fecha']),
+            'hora_inicio': fila['hora_inicio'],
+            'hora_fin': fila['hora_fin'],
+            'minuto_inicio': fila['minuto_inicio'],
+            'minuto_fin': fila['minuto_fin'],
+            'inicio': fields.Datetime.to_string(fila['datetime_inicio']),
+            'fin': fields.Datetime.to_string(fila['datetime_fin']),
+            'estado': fila['state'],
+            'personas': fila['cantidad_personas'],
+            'asignado_a': fila['asignado_a'],
+            'optometrista_id': fila['optometrista_id'],
+            'optometrista': nombres.get(fila['optometrista_id']),
+        } for fila in filas],
+    }
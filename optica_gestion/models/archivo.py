@@ -0,0 +1,134 @@
+from odoo import models, fields, api
+from dateutil.relativedelta import relativedelta
+from .sync_baja import registrar_bajas
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class OpticaConsultaArchivo(models.Model):
+    """Consultas históricas movidas fuera de la tabla de trabajo
+
+    Comparte la definición de optica.consulta pero vive en su propia tabla,
+    así listados, búsquedas y agregados de consultas solo recorren los datos
+    recientes. Los registros conservan el id original y son de solo lectura.
+    """
+    _name = 'optica.consulta.archivo'
+    _inherit = 'optica.consulta'
+    _description = 'Consulta Archivada'
+
+    dibujo_ids = fields.One2many(
+        'optica.dibujo.clinico.archivo',
+        'consulta_id',
+        string='Dibujos Clínicos'
+    )
+
+    @api.model
+    def _cron_archivar_consultas(self, meses=24, tamano_lote=2000, max_lotes=50):
+        """Mover al archivo las consultas con más de ``meses`` de antigüedad
+
+        Nunca se archiva la última consulta de un paciente. Cada lote se mueve
+        y se confirma por separado con sus dibujos, adjuntos, mensajes,
+        seguidores y actividades; como la selección depende solo de la fecha,
+        una ejecución interrumpida continúa en la siguiente sin repetir trabajo.
+        """
+        corte = fields.Date.context_today(self) - relativedelta(months=meses)
+        total = 0
+        for _lote in range(max_lotes):
+            movidas = self._archivar_lote(corte, tamano_lote)
+            if not movidas:
+                break
+            total += movidas
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        if total:
+            _logger.info("Archivo de consultas: %s consultas anteriores a %s archivadas", total, corte)
+        return True
+
+    def _archivar_lote(self, corte, tamano_lote):
+        """Mover un lote de consultas y sus dibujos; devuelve cuántas se movieron"""
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute(
+            """
+            SELECT c.id, c.partner_id
+              FROM optica_consulta c
+              JOIN res_partner p ON p.id = c.partner_id
+             WHERE c.fecha < %s
+               AND c.id IS DISTINCT FROM p.ultima_consulta_id
+          ORDER BY c.fecha, c.id
+             LIMIT %s
+               FOR UPDATE OF c SKIP LOCKED
+            """,
+            [corte, tamano_lote]
+        )
+        filas = cr.fetchall()
+        if not filas:
+            return 0
+        consulta_ids = [consulta_id for consulta_id, _partner_id in filas]
+
+        self._mover_registros(self.env['optica.consulta'], self, consulta_ids)
+        Dibujo = self.env['optica.dibujo.clinico']
+        cr.execute(f'SELECT id FROM "{Dibujo._table}" WHERE consulta_id = ANY(%s)', [consulta_ids])
+        dibujo_ids = [row[0] for row in cr.fetchall()]
+        if dibujo_ids:
+            self._mover_registros(Dibujo, self.env['optica.dibujo.clinico.archivo'], dibujo_ids)
+            cr.execute(f'DELETE FROM "{Dibujo._table}" WHERE id = ANY(%s)', [dibujo_ids])
+        cr.execute('DELETE FROM optica_consulta WHERE id = ANY(%s)', [consulta_ids])
+        registrar_bajas(self.env, 'optica_consulta', consulta_ids)
+
+        partner_ids = list({partner_id for _consulta_id, partner_id in filas})
+        self.env['res.partner'].browse(partner_ids)._actualizar_estadisticas_consultas()
+        return len(consulta_ids)
+
+    @api.model
+    def _mover_registros(self, origen, destino, ids):
+        """Copiar filas de ``origen`` a ``destino`` con el mismo id y reasignar
+        adjuntos, mensajes, seguidores y actividades al modelo de destino
+
+        Solo se copian las columnas almacenadas que existen en ambos modelos.
+        El borrado de las filas de origen queda a cargo del llamador.
+        """
+        columnas = ', '.join(f'"{nombre}"' for nombre in self._columnas_comunes(origen, destino))
+        cr = self.env.cr
+        cr.execute(
+            f"""
+            INSERT INTO "{destino._table}" ({columnas})
+            SELECT {columnas} FROM "{origen._table}" WHERE id = ANY(%s)
+            """,
+            [ids]
+        )
+        params = [destino._name, origen._name, ids]
+        cr.execute("UPDATE ir_attachment SET res_model = %s WHERE res_model = %s AND res_id = ANY(%s)", params)
+        cr.execute("UPDATE mail_message SET model = %s WHERE model = %s AND res_id = ANY(%s)", params)
+        cr.execute("UPDATE mail_followers SET res_model = %s WHERE res_model = %s AND res_id = ANY(%s)", params)
+        cr.execute(
+            """
+            UPDATE mail_activity SET res_model = %s, res_model_id = %s
+             WHERE res_model = %s AND res_id = ANY(%s)
+            """,
+            [destino._name, self.env['ir.model']._get_id(destino._name), origen._name, ids]
+        )
+
+    @api.model
+    def _columnas_comunes(self, origen, destino):
+        return [
+            nombre for nombre, campo in destino._fields.items()
+            if campo.store and campo.column_type
+            and nombre in origen._fields
+            and origen._fields[nombre].store and origen._fields[nombre].column_type
+        ]
+
+
+class OpticaDibujoClinicoArchivo(models.Model):
+    """Dibujos clínicos de las consultas archivadas (solo lectura)"""
+    _name = 'optica.dibujo.clinico.archivo'
+    _inherit = 'optica.dibujo.clinico'
+    _description = 'Dibujo Clínico Archivado'
+
+    consulta_id = fields.Many2one(
+        'optica.consulta.archivo',
+        string='Consulta',
+        required=True,
+        ondelete='cascade'
+    )
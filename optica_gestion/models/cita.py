@@ -1,16 +1,34 @@
 from odoo import models, fields, api
 from odoo.exceptions import ValidationError
+from odoo.tools import html2plaintext
+from .indices import crear_indices
+from .agenda import invalidar_cache_agenda
+from .reporte import marcar_pendientes
+from .sync_baja import registrar_bajas
 from datetime import datetime, timedelta
+import logging
+import psycopg2
+import psycopg2.errors
 import pytz
 
+_logger = logging.getLogger(__name__)
+
 
 class OpticaCita(models.Model):
     _name = 'optica.cita'
     _description = 'Cita de Óptica'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
-    _order = 'fecha desc, hora_inicio'
+    _inherit = ['optica.tracking.lote', 'mail.activity.mixin']
+    _order = 'fecha desc, minuto_inicio'
+
+    # Paciente (opcional: las citas también se agendan solo con datos de contacto)
+    partner_id = fields.Many2one(
+        'res.partner',
+        string='Paciente',
+        tracking=True,
+        domain=[('is_optica_patient', '=', True)]
+    )
 
-    # Datos de contacto (solo texto, no vinculado a paciente)
+    # Datos de contacto
     nombre = fields.Char(
         string='Nombre',
         required=True,
@@ -66,6 +84,30 @@ class OpticaCita(models.Model):
         default='9.5'
     )
     
+    # Minutos del día de cada opción de HORARIOS y viceversa (apertura y cierre
+    # de la rejilla); los horarios de atención se configuran en optica.horario
+    SLOT_MINUTOS = {key: round(float(key) * 60) for key, _label in HORARIOS}
+    MINUTO_SLOT = {minutos: key for key, minutos in SLOT_MINUTOS.items()}
+    PASO_HORARIO = 15
+    APERTURA = min(SLOT_MINUTOS.values())
+    CIERRE = max(SLOT_MINUTOS.values())
+
+    # Inicio y fin en minutos del día: rangos, duraciones y disponibilidad se
+    # calculan con enteros en lugar de interpretar las claves de HORARIOS
+    minuto_inicio = fields.Integer(
+        string='Minuto de Inicio',
+        compute='_compute_minutos',
+        store=True
+    )
+    minuto_fin = fields.Integer(
+        string='Minuto de Fin',
+        compute='_compute_minutos',
+        store=True
+    )
+
+    # Estados en los que la cita ocupa la agenda del optometrista
+    ESTADOS_OCUPADOS = ('borrador', 'confirmada', 'completada')
+
     # Campos Datetime computados para el calendario
     datetime_inicio = fields.Datetime(
         string='Inicio',
@@ -125,161 +167,503 @@ class OpticaCita(models.Model):
         user_tz = self.env.user.tz or 'America/Guatemala'
         return pytz.timezone(user_tz)
 
+    @api.onchange('partner_id')
+    def _onchange_partner_id(self):
+        """Copiar los datos de contacto del paciente"""
+        if self.partner_id:
+            self.nombre = self.partner_id.name
+            self.telefono = self.partner_id.phone
+            self.correo = self.partner_id.email
+
     @api.onchange('hora_inicio')
     def _onchange_hora_inicio(self):
-        """Al cambiar hora de inicio, auto-poner hora fin +15 min"""
+        """Al cambiar hora de inicio, poner como hora fin un turno del horario de atención"""
         if self.hora_inicio:
-            nuevo_fin = float(self.hora_inicio) + 0.25
-            nuevo_fin_str = str(nuevo_fin)
-            # Verificar que el valor existe en las opciones de horario
-            valores_validos = [h[0] for h in self.HORARIOS]
-            if nuevo_fin_str in valores_validos:
-                self.hora_fin = nuevo_fin_str
-
-    @api.depends('fecha', 'hora_inicio', 'hora_fin')
+            granularidad = self.env['optica.horario']._tabla_turnos(self.optometrista_id.id)[2]
+            nuevo_fin = self.MINUTO_SLOT.get(self.SLOT_MINUTOS[self.hora_inicio] + granularidad)
+            if nuevo_fin:
+                self.hora_fin = nuevo_fin
+
+    @api.depends('hora_inicio', 'hora_fin')
+    def _compute_minutos(self):
+        for record in self:
+            record.minuto_inicio = self.SLOT_MINUTOS.get(record.hora_inicio, 0)
+            record.minuto_fin = self.SLOT_MINUTOS.get(record.hora_fin, 0)
+
+    def _get_slot_converter(self):
+        """Conversor de (fecha, horario) a datetime UTC para un lote de citas
+
+        La zona horaria se resuelve una sola vez y cada combinación de fecha
+        y minuto del día se convierte una sola vez.
+        """
+        user_tz = self._get_user_timezone()
+        convertidos = {}
+
+        def convertir(fecha, minutos):
+            clave = (fecha, minutos)
+            if clave not in convertidos:
+                local = datetime.combine(fecha, datetime.min.time()) + timedelta(minutes=minutos)
+                convertidos[clave] = user_tz.localize(local).astimezone(pytz.UTC).replace(tzinfo=None)
+            return convertidos[clave]
+
+        return convertir
+
+    @api.depends('fecha', 'minuto_inicio', 'minuto_fin')
     def _compute_datetime(self):
+        convertir = self._get_slot_converter()
         for record in self:
             if record.fecha and record.hora_inicio and record.hora_fin:
-                hora_inicio_float = float(record.hora_inicio)
-                hora_fin_float = float(record.hora_fin)
-                
-                # Calcular hora y minutos de inicio
-                hours_inicio = int(hora_inicio_float)
-                minutes_inicio = int((hora_inicio_float - hours_inicio) * 60)
-                
-                # Calcular hora y minutos de fin
-                hours_fin = int(hora_fin_float)
-                minutes_fin = int((hora_fin_float - hours_fin) * 60)
-                
-                # Obtener zona horaria del usuario
-                user_tz = record._get_user_timezone()
-                
-                # Crear datetime en zona horaria local
-                fecha_dt = datetime.combine(record.fecha, datetime.min.time())
-                local_inicio = user_tz.localize(fecha_dt.replace(hour=hours_inicio, minute=minutes_inicio))
-                local_fin = user_tz.localize(fecha_dt.replace(hour=hours_fin, minute=minutes_fin))
-                
-                # Convertir a UTC para guardar en BD
-                record.datetime_inicio = local_inicio.astimezone(pytz.UTC).replace(tzinfo=None)
-                record.datetime_fin = local_fin.astimezone(pytz.UTC).replace(tzinfo=None)
+                # Guardar en UTC a partir de la hora local del usuario
+                record.datetime_inicio = convertir(record.fecha, record.minuto_inicio)
+                record.datetime_fin = convertir(record.fecha, record.minuto_fin)
             else:
                 record.datetime_inicio = False
                 record.datetime_fin = False
 
-    @api.depends('hora_inicio', 'hora_fin')
+    @api.model
+    def _recalcular_horarios(self, domain=None):
+        """Recalcular los datetime almacenados y encolar sus eventos de calendario
+
+        Útil tras un cambio de zona horaria: todo el lote comparte un único
+        conversor de horarios.
+        """
+        citas = self.search(domain or [])
+        for fname in ('datetime_inicio', 'datetime_fin'):
+            self.env.add_to_compute(self._fields[fname], citas)
+        citas.flush_recordset(['datetime_inicio', 'datetime_fin'])
+        self.env['optica.cita.sync']._encolar(citas.ids)
+        return True
+
+    @api.depends('minuto_inicio', 'minuto_fin')
     def _compute_duracion(self):
         for record in self:
             if record.hora_inicio and record.hora_fin:
-                inicio = float(record.hora_inicio)
-                fin = float(record.hora_fin)
-                diff = fin - inicio
-                if diff < 0:
-                    diff = 0
-                horas = int(diff)
-                minutos = int((diff - horas) * 60)
-                record.duracion = f"{horas}:{minutos:02d}"
+                diff = max(record.minuto_fin - record.minuto_inicio, 0)
+                record.duracion = f"{diff // 60}:{diff % 60:02d}"
             else:
                 record.duracion = "0:00"
 
+    # Agenda por día (fecha, minuto), calendario por optometrista, citas de un
+    # paciente y cambios recientes para el refresco de los cubos de reporte
+    _optica_indices = [
+        # Mismo orden que _order: la lista de citas se lee del índice sin ordenar
+        ('fecha_orden_idx', '(fecha DESC, minuto_inicio, minuto_fin)'),
+        ('optometrista_inicio_idx', '(optometrista_id, datetime_inicio) WHERE optometrista_id IS NOT NULL'),
+        ('partner_fecha_idx', '(partner_id, fecha) WHERE partner_id IS NOT NULL'),
+        ('write_date_idx', '(write_date)'),
+    ]
+
+    def init(self):
+        """Índices de la agenda y restricción de solapamiento por optometrista"""
+        cr = self.env.cr
+        crear_indices(cr, self._table, self._optica_indices)
+        cr.execute(
+            "SELECT 1 FROM pg_constraint WHERE conname = 'optica_cita_sin_solapamiento'"
+        )
+        if cr.fetchone():
+            return
+        estados = ', '.join("'%s'" % estado for estado in self.ESTADOS_OCUPADOS)
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+                cr.execute(f"""
+                    ALTER TABLE optica_cita
+                    ADD CONSTRAINT optica_cita_sin_solapamiento
+                    EXCLUDE USING gist (
+                        optometrista_id WITH =,
+                        tsrange(datetime_inicio, datetime_fin) WITH &&
+                    ) WHERE (
+                        optometrista_id IS NOT NULL
+                        AND datetime_inicio < datetime_fin
+                        AND state IN ({estados})
+                    )
+                """)
+        except psycopg2.Error as e:
+            _logger.warning(
+                "No se pudo crear la restricción de solapamiento de citas: %s", e
+            )
+
+    @api.constrains('hora_inicio', 'hora_fin', 'optometrista_id')
+    def _check_turno(self):
+        """Validar que la cita ocupe turnos completos dentro del horario de atención"""
+        Horario = self.env['optica.horario']
+        for cita in self:
+            apertura, cierre, granularidad, turnos = Horario._tabla_turnos(cita.optometrista_id.id)
+            if cita.minuto_inicio >= cita.minuto_fin:
+                raise ValidationError("La hora de fin de la cita de %s debe ser posterior a la de inicio." % cita.nombre)
+            if cita.minuto_inicio < apertura or cita.minuto_fin > cierre:
+                raise ValidationError(
+                    "La cita de %s está fuera del horario de atención (%s a %s)."
+                    % (cita.nombre, self.MINUTO_SLOT.get(apertura, apertura), self.MINUTO_SLOT.get(cierre, cierre))
+                )
+            if cita.minuto_inicio not in turnos or (cita.minuto_fin - cita.minuto_inicio) % granularidad:
+                raise ValidationError(
+                    "La cita de %s debe ocupar turnos completos de %s minutos." % (cita.nombre, granularidad)
+                )
+
+    @api.constrains('fecha', 'hora_inicio', 'hora_fin', 'optometrista_id', 'state')
+    def _check_solapamiento(self):
+        """Validar solapamientos de todo el lote con una sola consulta"""
+        citas = self.filtered(
+            lambda c: c.optometrista_id and c.state in self.ESTADOS_OCUPADOS
+            and c.datetime_inicio and c.datetime_fin
+            and c.datetime_inicio < c.datetime_fin
+        )
+        if not citas:
+            return
+        self.env.cr.execute(
+            """
+            WITH nuevas AS (
+                SELECT *
+                  FROM unnest(%s::int[], %s::int[], %s::timestamp[], %s::timestamp[])
+                       AS n(id, optometrista_id, inicio, fin)
+            )
+            SELECT n.id
+              FROM nuevas n
+             WHERE EXISTS (
+                    SELECT 1
+                      FROM optica_cita c
+                     WHERE c.optometrista_id = n.optometrista_id
+                       AND c.state IN %s
+                       AND c.datetime_inicio < c.datetime_fin
+                       AND tsrange(c.datetime_inicio, c.datetime_fin) && tsrange(n.inicio, n.fin)
+                       AND c.id != ALL(%s)
+                   )
+                OR EXISTS (
+                    SELECT 1
+                      FROM nuevas o
+                     WHERE o.optometrista_id = n.optometrista_id
+                       AND o.id != n.id
+                       AND tsrange(o.inicio, o.fin) && tsrange(n.inicio, n.fin)
+                   )
+             LIMIT 1
+            """,
+            [
+                citas.ids,
+                [c.optometrista_id.id for c in citas],
+                [c.datetime_inicio for c in citas],
+                [c.datetime_fin for c in citas],
+                self.ESTADOS_OCUPADOS,
+                citas.ids,
+            ]
+        )
+        row = self.env.cr.fetchone()
+        if row:
+            cita = self.browse(row[0])
+            raise ValidationError(
+                "La cita de %s se solapa con otra cita de %s." % (cita.nombre, cita.optometrista_id.name)
+            )
+
+    # Contexto de las escrituras en calendar.event: el worker no es el
+    # optometrista, así que sin esto el calendario enviaría invitaciones y
+    # avisos de cambio por cada cita sincronizada
+    CONTEXTO_CALENDARIO = {
+        'active_test': False,
+        'no_mail_to_attendees': True,
+        'dont_notify': True,
+        'mail_create_nolog': True,
+        'tracking_disable': True,
+    }
+
+    # Campos de la cita que se reflejan en el evento de calendario
+    CAMPOS_EVENTO = {'nombre', 'notas', 'fecha', 'hora_inicio', 'hora_fin', 'state', 'optometrista_id'}
+
     @api.model_create_multi
     def create(self, vals_list):
         records = super().create(vals_list)
-        for record in records:
-            record._create_calendar_event()
+        self.env['optica.cita.sync']._encolar(records.ids)
+        invalidar_cache_agenda(self.env)
         return records
 
     def write(self, vals):
+        if 'fecha' in vals:
+            marcar_pendientes(self)
+            # Las tabletas solo tienen las citas de un día
+            registrar_bajas(self.env, self._table, self.ids)
         res = super().write(vals)
-        if any(field in vals for field in ['fecha', 'hora_inicio', 'hora_fin', 'nombre', 'notas']):
-            for record in self:
-                record._update_calendar_event()
+        invalidar_cache_agenda(self.env)
+        if self.CAMPOS_EVENTO.intersection(vals):
+            self.env['optica.cita.sync']._encolar(self.ids)
         return res
 
     def unlink(self):
-        for record in self:
-            if record.calendar_event_id:
-                record.calendar_event_id.unlink()
+        marcar_pendientes(self)
+        registrar_bajas(self.env, self._table, self.ids)
+        self.env['optica.cita.sync']._encolar(
+            self.ids, accion='eliminar', event_ids=[cita.calendar_event_id.id or None for cita in self]
+        )
+        invalidar_cache_agenda(self.env)
         return super().unlink()
 
-    def _create_calendar_event(self):
+    def _prepare_calendar_event_vals(self):
+        """Valores del evento de calendario asociados a la cita
+
+        Se usan los mismos datetime UTC almacenados en la cita para que el
+        evento coincida con la vista de calendario de citas.
+        """
         self.ensure_one()
-        if self.calendar_event_id or not self.nombre:
-            return
-        
-        hora_inicio_float = float(self.hora_inicio) if self.hora_inicio else 9.0
-        hora_fin_float = float(self.hora_fin) if self.hora_fin else 9.5
-        
-        start_datetime = fields.Datetime.to_datetime(self.fecha)
-        hours = int(hora_inicio_float)
-        minutes = int((hora_inicio_float - hours) * 60)
-        start_datetime = start_datetime.replace(hour=hours, minute=minutes)
-        
-        end_hours = int(hora_fin_float)
-        end_minutes = int((hora_fin_float - end_hours) * 60)
-        stop_datetime = fields.Datetime.to_datetime(self.fecha).replace(hour=end_hours, minute=end_minutes)
-        
-        event = self.env['calendar.event'].create({
+        return {
             'name': f"Cita Óptica: {self.nombre}",
-            'start': start_datetime,
-            'stop': stop_datetime,
+            'start': self.datetime_inicio,
+            'stop': self.datetime_fin,
             'description': self.notas or '',
-            'user_id': self.env.user.id,
-        })
-        self.calendar_event_id = event.id
+            'active': self.state not in self.ESTADOS_SIN_EVENTO,
+        }
 
-    def _update_calendar_event(self):
-        self.ensure_one()
-        if not self.calendar_event_id:
-            self._create_calendar_event()
+    def _link_calendar_events(self, events):
+        """Enlazar cada cita con su evento en una sola sentencia UPDATE"""
+        if not self:
             return
-        if not self.nombre:
+        self.env.cr.execute(
+            """
+            UPDATE optica_cita AS cita
+               SET calendar_event_id = enlace.event_id
+              FROM unnest(%s::int[], %s::int[]) AS enlace(cita_id, event_id)
+             WHERE cita.id = enlace.cita_id
+            """,
+            [self.ids, events.ids]
+        )
+        self.invalidate_recordset(['calendar_event_id'])
+
+    def _sincronizar_calendario(self):
+        """Dejar el evento de calendario de cada cita igual a la cita
+
+        Lo ejecuta el worker de optica.cita.sync. Es idempotente: el evento se
+        busca por la cita (res_model/res_id) o por el enlace existente, se
+        crea solo si no hay ninguno y solo se escriben los valores que
+        difieren, agrupando en lote los eventos con los mismos cambios.
+        """
+        citas = self.filtered(lambda c: c.nombre and c.datetime_inicio)
+        if not citas:
             return
-        
-        hora_inicio_float = float(self.hora_inicio) if self.hora_inicio else 9.0
-        hora_fin_float = float(self.hora_fin) if self.hora_fin else 9.5
-        
-        start_datetime = fields.Datetime.to_datetime(self.fecha)
-        hours = int(hora_inicio_float)
-        minutes = int((hora_inicio_float - hours) * 60)
-        start_datetime = start_datetime.replace(hour=hours, minute=minutes)
-        
-        end_hours = int(hora_fin_float)
-        end_minutes = int((hora_fin_float - end_hours) * 60)
-        stop_datetime = fields.Datetime.to_datetime(self.fecha).replace(hour=end_hours, minute=end_minutes)
-        
-        self.calendar_event_id.write({
-            'name': f"Cita Óptica: {self.nombre}",
-            'start': start_datetime,
-            'stop': stop_datetime,
-            'description': self.notas or '',
-        })
+        Event = self.env['calendar.event'].with_context(**self.CONTEXTO_CALENDARIO)
+        modelo_id = self.env['ir.model']._get_id(self._name)
+        eventos = {}
+        for evento in Event.search([('res_model', '=', self._name), ('res_id', 'in', citas.ids)], order='id'):
+            eventos.setdefault(evento.res_id, evento)
+        for cita in citas:
+            if cita.id not in eventos and cita.calendar_event_id:
+                eventos[cita.id] = cita.calendar_event_id
+
+        crear, grupos, enlazar = [], {}, []
+        for cita in citas:
+            vals = cita._prepare_calendar_event_vals()
+            evento = eventos.get(cita.id)
+            if not evento:
+                crear.append(cita)
+                continue
+            cambios = {
+                campo: valor for campo, valor in vals.items()
+                if campo != 'description' and evento[campo] != valor
+            }
+            if html2plaintext(evento.description or '') != vals['description'].strip():
+                cambios['description'] = vals['description']
+            if evento.res_model != self._name or evento.res_id != cita.id:
+                cambios.update(res_model_id=modelo_id, res_id=cita.id)
+            # El evento sigue al optometrista asignado (organizador y asistente)
+            responsable = cita.optometrista_id or cita.create_uid
+            if evento.user_id != responsable:
+                cambios['user_id'] = responsable.id
+            if evento.partner_ids != responsable.partner_id:
+                cambios['partner_ids'] = ((6, 0, tuple(responsable.partner_id.ids)),)
+            if cambios:
+                grupos.setdefault(tuple(sorted(cambios.items())), []).append(evento.id)
+            if cita.calendar_event_id != evento:
+                enlazar.append((cita.id, evento.id))
+        for clave, event_ids in grupos.items():
+            Event.browse(event_ids).write(dict(clave))
+
+        if crear:
+            vals_list = []
+            for cita in crear:
+                responsable = cita.optometrista_id or cita.create_uid
+                vals = cita._prepare_calendar_event_vals()
+                vals.update(
+                    res_model_id=modelo_id,
+                    res_id=cita.id,
+                    user_id=responsable.id,
+                    partner_ids=[(6, 0, responsable.partner_id.ids)],
+                )
+                vals_list.append(vals)
+            nuevos = Event.create(vals_list)
+            enlazar.extend(zip([cita.id for cita in crear], nuevos.ids))
+        if enlazar:
+            cita_ids, event_ids = zip(*enlazar)
+            self.browse(cita_ids)._link_calendar_events(Event.browse(event_ids))
+
+    # ==================== DISPONIBILIDAD ====================
+
+    @api.model
+    def buscar_horarios_libres(self, optometrista_ids, fecha_desde, fecha_hasta=None, duracion=30, limite=1):
+        """Buscar huecos libres en los turnos del horario de atención de cada optometrista
+
+        Se ejecuta una sola consulta por optometrista, apoyada en el índice
+        GiST de la restricción de solapamiento.
+
+        :param optometrista_ids: ids de ``res.users`` a consultar
+        :param fecha_desde: primera fecha de la búsqueda
+        :param fecha_hasta: última fecha de la búsqueda (por defecto, una semana)
+        :param duracion: duración del hueco en minutos, múltiplo del turno
+        :param limite: número máximo de huecos por optometrista
+        :return: diccionario ``{optometrista_id: [hueco, ...]}`` donde cada hueco
+            tiene ``fecha``, ``hora_inicio``, ``hora_fin``, ``minuto_inicio``,
+            ``minuto_fin``, ``datetime_inicio`` y ``datetime_fin``
+        """
+        fecha_desde = fields.Date.to_date(fecha_desde)
+        fecha_hasta = fields.Date.to_date(fecha_hasta) if fecha_hasta else fecha_desde + timedelta(days=6)
+        self.flush_model(['optometrista_id', 'state', 'datetime_inicio', 'datetime_fin'])
+
+        params = {
+            'tz': self._get_user_timezone().zone,
+            'desde': fecha_desde,
+            'hasta': fecha_hasta,
+            'duracion': duracion,
+            'ahora': fields.Datetime.now(),
+            'estados': self.ESTADOS_OCUPADOS,
+            'limite': limite,
+        }
+        resultado = {}
+        for optometrista_id in optometrista_ids:
+            apertura, cierre, granularidad, _turnos = self.env['optica.horario']._tabla_turnos(optometrista_id)
+            if duracion <= 0 or duracion % granularidad:
+                raise ValidationError("La duración debe ser un múltiplo de %s minutos." % granularidad)
+            params.update(optometrista=optometrista_id, apertura=apertura, cierre=cierre, paso=granularidad)
+            self.env.cr.execute(
+                """
+                WITH huecos AS (
+                    SELECT dia::date AS fecha,
+                           minuto,
+                           ((dia + make_interval(mins => minuto))
+                                AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC' AS inicio,
+                           ((dia + make_interval(mins => minuto + %(duracion)s))
+                                AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC' AS fin
+                      FROM generate_series(%(desde)s::timestamp, %(hasta)s::timestamp, interval '1 day') AS dia,
+                           generate_series(%(apertura)s, %(cierre)s - %(duracion)s, %(paso)s) AS minuto
+                )
+                SELECT h.fecha, h.minuto, h.inicio, h.fin
+                  FROM huecos h
+                 WHERE h.inicio >= %(ahora)s
+                   AND NOT EXISTS (
+                        SELECT 1
+                          FROM optica_cita c
+                         WHERE c.optometrista_id = %(optometrista)s
+                           AND c.state IN %(estados)s
+                           AND c.datetime_inicio < c.datetime_fin
+                           AND tsrange(c.datetime_inicio, c.datetime_fin) && tsrange(h.inicio, h.fin)
+                       )
+                 ORDER BY h.inicio
+                 LIMIT %(limite)s
+                """,
+                params
+            )
+            resultado[optometrista_id] = [{
+                'fecha': fecha,
+                'hora_inicio': self.MINUTO_SLOT[minuto],
+                'hora_fin': self.MINUTO_SLOT[minuto + duracion],
+                'minuto_inicio': minuto,
+                'minuto_fin': minuto + duracion,
+                'datetime_inicio': inicio,
+                'datetime_fin': fin,
+            } for fecha, minuto, inicio, fin in self.env.cr.fetchall()]
+        return resultado
 
     def action_guardar_borrador(self):
         return True
 
+    # ==================== ESTADOS ====================
+    # Transiciones permitidas: estado destino -> estados de origen
+    TRANSICIONES = {
+        'confirmada': ('borrador',),
+        'completada': ('confirmada',),
+        'cancelada': ('borrador', 'confirmada'),
+        'no_asistio': ('confirmada',),
+        'borrador': ('cancelada', 'no_asistio'),
+    }
+
+    # Estados cuyo evento de calendario queda archivado
+    ESTADOS_SIN_EVENTO = ('cancelada', 'no_asistio')
+
+    # Estados que cierran las actividades pendientes de la cita
+    ESTADOS_CERRADOS = ('completada', 'cancelada', 'no_asistio')
+
+    def _aplicar_transicion(self, nuevo_estado):
+        """Cambiar de estado todo el lote con un solo UPDATE
+
+        Solo cambian las citas cuyo estado actual permite la transición según
+        TRANSICIONES; las que vuelven a ocupar turno se validan contra
+        solapamientos antes de confirmar el cambio. Después se ejecutan en
+        lote los efectos secundarios: tracking, encolado de la sincronización
+        de eventos y cierre de las actividades pendientes como hechas.
+
+        :return: citas que cambiaron de estado
+        """
+        if not self.ids:
+            return self.browse()
+        self.flush_recordset(['state'])
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute(
+                    """
+                    UPDATE optica_cita AS cita
+                       SET state = %s,
+                           write_uid = %s,
+                           write_date = %s
+                      FROM (
+                            SELECT id, state
+                              FROM optica_cita
+                             WHERE id = ANY(%s) AND state IN %s
+                               FOR UPDATE
+                           ) AS anterior
+                     WHERE cita.id = anterior.id
+                 RETURNING cita.id, anterior.state
+                    """,
+                    [nuevo_estado, self.env.uid, self.env.cr.now(), self.ids, self.TRANSICIONES[nuevo_estado]]
+                )
+                anteriores = dict(self.env.cr.fetchall())
+                reabiertas = self.browse([
+                    cita_id for cita_id, estado in anteriores.items()
+                    if nuevo_estado in self.ESTADOS_OCUPADOS and estado not in self.ESTADOS_OCUPADOS
+                ])
+                if reabiertas:
+                    # La restricción de exclusión puede no existir (por ejemplo, sin
+                    # btree_gist): validar también aquí las citas que vuelven a ocupar turno
+                    reabiertas.invalidate_recordset(['state'])
+                    reabiertas._check_solapamiento()
+        except psycopg2.errors.ExclusionViolation:
+            raise ValidationError("No se puede reabrir: alguna cita se solapa con otra del mismo optometrista.")
+        self.invalidate_recordset(['state', 'write_uid', 'write_date'])
+        citas = self.browse(list(anteriores))
+        if not citas:
+            return citas
+        citas.modified(['state'])
+        invalidar_cache_agenda(self.env)
+
+        if not self.env.context.get('tracking_disable'):
+            citas._registrar_tracking_lote({
+                cita_id: {'state': estado} for cita_id, estado in anteriores.items()
+            })
+        self.env['optica.cita.sync']._encolar(citas.ids)
+        if nuevo_estado in self.ESTADOS_CERRADOS and citas.activity_ids:
+            estado = dict(self._fields['state']._description_selection(self.env))[nuevo_estado]
+            citas.activity_ids.sudo().action_feedback(feedback="Cita %s" % estado.lower())
+        return citas
+
     def action_confirmar(self):
-        self.write({'state': 'confirmada'})
+        self._aplicar_transicion('confirmada')
+        return True
 
     def action_completar(self):
-        self.write({'state': 'completada'})
+        self._aplicar_transicion('completada')
+        return True
 
     def action_cancelar(self):
-        if self.ids:
-            self.env.cr.execute(
-                "UPDATE optica_cita SET state = 'cancelada' WHERE id IN %s",
-                [tuple(self.ids)]
-            )
-            self.invalidate_recordset(['state'])
+        self._aplicar_transicion('cancelada')
         return True
 
     def action_no_asistio(self):
-        if self.ids:
-            self.env.cr.execute(
-                "UPDATE optica_cita SET state = 'no_asistio' WHERE id IN %s",
-                [tuple(self.ids)]
-            )
-            self.invalidate_recordset(['state'])
+        self._aplicar_transicion('no_asistio')
         return True
 
     def action_reabrir(self):
-        self.write({'state': 'borrador'})
+        self._aplicar_transicion('borrador')
+        return True
@@ -0,0 +1,228 @@
+from odoo import models, fields, api, SUPERUSER_ID
+from dateutil.relativedelta import relativedelta
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Intentos de un trabajo antes de dejarlo para revisión manual
+MAX_INTENTOS = 5
+
+
+class OpticaCitaSync(models.Model):
+    """Cola persistente de sincronización de citas con el calendario
+
+    Hay como máximo un trabajo por cita: las ediciones repetidas actualizan
+    el trabajo pendiente en lugar de encolar otro. El cron worker aplica los
+    trabajos por lotes y el pase de reconciliación corrige las diferencias
+    que queden entre citas y eventos.
+    """
+    _name = 'optica.cita.sync'
+    _description = 'Sincronización de Cita con Calendario'
+    _order = 'id'
+
+    cita_id = fields.Integer(string='Cita', required=True, readonly=True)
+    accion = fields.Selection([
+        ('sincronizar', 'Sincronizar'),
+        ('eliminar', 'Eliminar evento')
+    ], string='Acción', required=True, default='sincronizar', readonly=True)
+    event_id = fields.Integer(string='Evento', readonly=True)
+    intentos = fields.Integer(string='Intentos', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    def init(self):
+        self.env.cr.execute(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS "{self._table}_cita_uniq" ON "{self._table}" (cita_id)'
+        )
+
+    @api.model
+    def _encolar(self, cita_ids, accion='sincronizar', event_ids=None):
+        """Encolar (o fusionar con el pendiente) un trabajo por cita y despertar al worker"""
+        cita_ids = [cita_id for cita_id in cita_ids if isinstance(cita_id, int)]
+        if not cita_ids:
+            return
+        if event_ids is None:
+            event_ids = [None] * len(cita_ids)
+        self.env.cr.execute(
+            f"""
+            INSERT INTO "{self._table}" (cita_id, accion, event_id, intentos,
+                                         create_uid, create_date, write_uid, write_date)
+            SELECT cita_id, %s, event_id, 0, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::int[]) AS t(cita_id, event_id)
+            ON CONFLICT (cita_id) DO UPDATE
+               SET accion = EXCLUDED.accion,
+                   event_id = COALESCE(EXCLUDED.event_id, "{self._table}".event_id),
+                   intentos = 0,
+                   error = NULL,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+            """,
+            [accion, self.env.uid, self.env.uid, cita_ids, event_ids]
+        )
+        # Un solo disparo del cron por transacción, después de confirmarla: antes
+        # el worker podría arrancar sin ver todavía los trabajos
+        postcommit = self.env.cr.postcommit
+        if 'optica.cita.sync' not in postcommit.data:
+            postcommit.data['optica.cita.sync'] = True
+            registry, context = self.env.registry, self.env.context
+
+            @postcommit.add
+            def despertar_worker():
+                with registry.cursor() as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, context)
+                    env.ref('optica_gestion.ir_cron_sincronizar_calendario')._trigger()
+
+    @api.model
+    def _cron_procesar_cola(self, tamano_lote=200, max_lotes=50):
+        """Aplicar los trabajos pendientes por lotes, confirmando cada uno
+
+        Los trabajos bloqueados por otro worker se saltan. Si un lote falla,
+        sus trabajos se reintentan uno a uno y solo los que vuelven a fallar
+        suman un intento y guardan el error; esos no se retoman en la misma
+        ejecución y se reintentan hasta MAX_INTENTOS veces.
+        """
+        cr = self.env.cr
+        fallidos = []
+        for _lote in range(max_lotes):
+            cr.execute(
+                f"""
+                SELECT id, cita_id, accion, event_id
+                  FROM "{self._table}"
+                 WHERE intentos < %s
+                   AND id <> ALL(%s)
+              ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+                """,
+                [MAX_INTENTOS, fallidos, tamano_lote]
+            )
+            trabajos = cr.fetchall()
+            if not trabajos:
+                break
+            try:
+                with cr.savepoint():
+                    self._aplicar_trabajos(trabajos)
+                hechos, errores = [trabajo[0] for trabajo in trabajos], []
+            except Exception:
+                _logger.warning("Sincronización de calendario: falló un lote de %s citas, "
+                                "se reintenta una a una", len(trabajos))
+                hechos, errores = self._aplicar_uno_a_uno(trabajos)
+            if hechos:
+                cr.execute(f'DELETE FROM "{self._table}" WHERE id = ANY(%s)', [hechos])
+            if errores:
+                cr.execute(
+                    f"""
+                    UPDATE "{self._table}" AS t
+                       SET intentos = t.intentos + 1, error = e.error
+                      FROM unnest(%s::int[], %s::text[]) AS e(id, error)
+                     WHERE t.id = e.id
+                    """,
+                    [[trabajo_id for trabajo_id, _error in errores], [error for _id, error in errores]]
+                )
+                fallidos += [trabajo_id for trabajo_id, _error in errores]
+            cr.commit()
+            self.env.invalidate_all()
+        return True
+
+    @api.model
+    def _aplicar_uno_a_uno(self, trabajos):
+        """Aplicar cada trabajo en su propio savepoint
+
+        :return: ``(ids aplicados, [(id, error)] de los que fallaron)``
+        """
+        hechos, errores = [], []
+        for trabajo in trabajos:
+            try:
+                with self.env.cr.savepoint():
+                    self._aplicar_trabajos([trabajo])
+                hechos.append(trabajo[0])
+            except Exception as e:
+                _logger.exception("Sincronización de calendario: fallo en la cita %s", trabajo[1])
+                errores.append((trabajo[0], str(e)))
+        return hechos, errores
+
+    @api.model
+    def _aplicar_trabajos(self, trabajos):
+        Cita = self.env['optica.cita']
+        sincronizar = [cita_id for _id, cita_id, accion, _event_id in trabajos if accion == 'sincronizar']
+        Cita.browse(sincronizar).exists()._sincronizar_calendario()
+
+        eliminar = [(cita_id, event_id) for _id, cita_id, accion, event_id in trabajos if accion == 'eliminar']
+        if eliminar:
+            Event = self.env['calendar.event'].with_context(**Cita.CONTEXTO_CALENDARIO)
+            eventos = Event.browse([event_id for _cita_id, event_id in eliminar if event_id]).exists()
+            eventos |= Event.search([
+                ('res_model', '=', Cita._name),
+                ('res_id', 'in', [cita_id for cita_id, _event_id in eliminar]),
+            ])
+            eventos.unlink()
+
+    @api.model
+    def _cron_reconciliar(self, dias=30, tamano_lote=1000):
+        """Encolar las citas cuyo evento no coincide con ellas y borrar eventos huérfanos
+
+        Primero completa con SQL el res_model/res_id de los eventos enlazados
+        que no lo tienen. Después revisa las citas desde hace ``dias`` días:
+        evento ausente, con otro horario o con el estado activo equivocado
+        (por ejemplo, cambios de estado hechos directamente por SQL). Los eventos de citas que ya no
+        existen, o que no son el evento enlazado de su cita, se eliminan,
+        salvo los de citas con un trabajo todavía en la cola.
+        """
+        cr = self.env.cr
+        self.env.flush_all()
+        Cita = self.env['optica.cita']
+        # Los eventos enlazados sin res_model/res_id (anteriores a la cola) se
+        # completan con SQL: reescribirlos por el ORM avisaría a los asistentes
+        cr.execute(
+            """
+            UPDATE calendar_event e
+               SET res_model_id = %s, res_model = %s, res_id = c.id
+              FROM optica_cita c
+             WHERE c.calendar_event_id = e.id
+               AND (e.res_model IS DISTINCT FROM %s OR e.res_id IS DISTINCT FROM c.id)
+            """,
+            [self.env['ir.model']._get_id(Cita._name), Cita._name, Cita._name]
+        )
+        if cr.rowcount:
+            self.env['calendar.event'].invalidate_model(['res_model_id', 'res_model', 'res_id'])
+            cr.commit()
+        cr.execute(
+            """
+            SELECT c.id
+              FROM optica_cita c
+         LEFT JOIN calendar_event e ON e.id = c.calendar_event_id
+             WHERE c.fecha >= %s
+               AND c.nombre IS NOT NULL
+               AND (e.id IS NULL
+                    OR e.start IS DISTINCT FROM c.datetime_inicio
+                    OR e.stop IS DISTINCT FROM c.datetime_fin
+                    OR e.active IS DISTINCT FROM (c.state NOT IN %s))
+            """,
+            [fields.Date.context_today(self) - relativedelta(days=dias), Cita.ESTADOS_SIN_EVENTO]
+        )
+        desfasadas = [row[0] for row in cr.fetchall()]
+        for inicio in range(0, len(desfasadas), tamano_lote):
+            self._encolar(desfasadas[inicio:inicio + tamano_lote])
+            cr.commit()
+
+        cr.execute(
+            f"""
+            SELECT e.id
+              FROM calendar_event e
+         LEFT JOIN optica_cita c ON c.id = e.res_id
+             WHERE e.res_model = %s
+               AND (c.id IS NULL OR c.calendar_event_id IS DISTINCT FROM e.id)
+               AND NOT EXISTS (SELECT 1 FROM "{self._table}" s WHERE s.cita_id = e.res_id)
+            """,
+            [Cita._name]
+        )
+        huerfanos = [row[0] for row in cr.fetchall()]
+        Event = self.env['calendar.event'].with_context(**Cita.CONTEXTO_CALENDARIO)
+        for inicio in range(0, len(huerfanos), tamano_lote):
+            Event.browse(huerfanos[inicio:inicio + tamano_lote]).unlink()
+            cr.commit()
+        if desfasadas or huerfanos:
+            _logger.info(
+                "Reconciliación de calendario: %s citas encoladas, %s eventos huérfanos eliminados",
+                len(desfasadas), len(huerfanos)
+            )
+        return True
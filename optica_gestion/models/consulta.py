@@ -1,10 +1,26 @@
 from odoo import models, fields, api
+from odoo.tools import split_every
+from .indices import crear_indices
+from .reporte import marcar_pendientes
+from .sync_baja import registrar_bajas
+from .parametros import leer_parametro, guardar_parametro
+import io
+
+# Parámetro con el último id procesado por el relleno de graduaciones numéricas
+PARAM_BACKFILL_REFRACCION = 'optica_gestion.refraccion_backfill_id'
+
+# Recetas renderizadas por cada llamada a wkhtmltopdf en la impresión por lotes
+TAMANO_LOTE_RECETAS = 50
+
+# Nombre del adjunto con el PDF de la receta (la misma expresión que el
+# campo attachment de action_report_receta)
+NOMBRE_ADJUNTO_RECETA = 'receta-%s.pdf'
 
 
 class OpticaConsulta(models.Model):
     _name = 'optica.consulta'
     _description = 'Consulta/Examen Visual'
-    _inherit = ['mail.thread', 'mail.activity.mixin']
+    _inherit = ['optica.tracking.lote', 'mail.activity.mixin']
     _order = 'fecha desc, id desc'
     _rec_name = 'display_name'
 
@@ -118,6 +134,56 @@ class OpticaConsulta(models.Model):
     rx_oi_add = fields.Char(string='ADD')
     rx_oi_av = fields.Char(string='AV')
 
+    # ==================== GRADUACIONES NUMÉRICAS ====================
+    # Copias numéricas de los valores de texto para búsquedas y reportes en SQL.
+    # Se sincronizan en create/write mediante optica_parse_graduacion().
+    CAMPOS_REFRACCION = (
+        'lens_od_esfera', 'lens_od_cilindro', 'lens_od_eje', 'lens_od_add',
+        'lens_oi_esfera', 'lens_oi_cilindro', 'lens_oi_eje', 'lens_oi_add',
+        'ret_od_esfera', 'ret_od_cilindro', 'ret_od_eje',
+        'ret_oi_esfera', 'ret_oi_cilindro', 'ret_oi_eje',
+        'rx_od_esfera', 'rx_od_cilindro', 'rx_od_eje', 'rx_od_add',
+        'rx_oi_esfera', 'rx_oi_cilindro', 'rx_oi_eje', 'rx_oi_add',
+    )
+    # Campos impresos en la receta (report/receta_templates.xml): al cambiar
+    # alguno se descarta el PDF guardado
+    CAMPOS_RECETA = frozenset((
+        'partner_id', 'edad_consulta', 'fecha', 'realizado_por',
+        'rx_od_esfera', 'rx_od_cilindro', 'rx_od_eje', 'rx_od_add', 'rx_od_av',
+        'rx_oi_esfera', 'rx_oi_cilindro', 'rx_oi_eje', 'rx_oi_add', 'rx_oi_av',
+        'dip_od', 'dip_oi', 'dip_total', 'tipo_lente', 'material_lente', 'tratamientos_lente',
+        'rx_observaciones', 'proxima_cita_sugerida',
+    ))
+    # Valores de la línea de tiempo de refracción del paciente (ver res.partner)
+    CAMPOS_HISTORIAL = tuple(f'{campo}_num' for campo in CAMPOS_REFRACCION) + (
+        'presion_od', 'presion_oi', 'dip_od', 'dip_oi', 'dip_total',
+    )
+
+    lens_od_esfera_num = fields.Float(string='Lens OD Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_od_cilindro_num = fields.Float(string='Lens OD Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_od_eje_num = fields.Float(string='Lens OD Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_od_add_num = fields.Float(string='Lens OD ADD (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_oi_esfera_num = fields.Float(string='Lens OI Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_oi_cilindro_num = fields.Float(string='Lens OI Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_oi_eje_num = fields.Float(string='Lens OI Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    lens_oi_add_num = fields.Float(string='Lens OI ADD (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+
+    ret_od_esfera_num = fields.Float(string='Ret OD Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    ret_od_cilindro_num = fields.Float(string='Ret OD Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    ret_od_eje_num = fields.Float(string='Ret OD Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    ret_oi_esfera_num = fields.Float(string='Ret OI Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    ret_oi_cilindro_num = fields.Float(string='Ret OI Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    ret_oi_eje_num = fields.Float(string='Ret OI Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+
+    rx_od_esfera_num = fields.Float(string='RX OD Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_od_cilindro_num = fields.Float(string='RX OD Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_od_eje_num = fields.Float(string='RX OD Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_od_add_num = fields.Float(string='RX OD ADD (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_oi_esfera_num = fields.Float(string='RX OI Esfera (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_oi_cilindro_num = fields.Float(string='RX OI Cilindro (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_oi_eje_num = fields.Float(string='RX OI Eje (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+    rx_oi_add_num = fields.Float(string='RX OI ADD (num.)', readonly=True, copy=False, index='btree_not_null', aggregator='avg')
+
     # ==================== OBSERVACIONES RX ====================
     rx_observaciones = fields.Text(string='RX')
     
@@ -189,6 +255,141 @@ class OpticaConsulta(models.Model):
             else:
                 record.display_name = "Nueva Consulta"
 
+    # Historial de un paciente y listado general, ambos en el orden de _order,
+    # y cambios recientes para el refresco de los cubos de reporte
+    _optica_indices = [
+        ('partner_fecha_idx', '(partner_id, fecha DESC, id DESC)'),
+        ('fecha_id_idx', '(fecha DESC, id DESC)'),
+        ('write_date_idx', '(write_date)'),
+    ]
+
+    def init(self):
+        """Índices de acceso y función SQL que convierte una graduación en texto a número
+
+        Acepta coma decimal, signo explícito, grados y la "x" del eje.
+        Los valores neutros (N, PL, plano, esf) se interpretan como 0 y
+        cualquier otro texto no numérico como NULL.
+        """
+        crear_indices(self.env.cr, self._table, self._optica_indices)
+        self.env.cr.execute("""
+            CREATE OR REPLACE FUNCTION optica_parse_graduacion(valor text)
+            RETURNS numeric
+            LANGUAGE plpgsql IMMUTABLE
+            AS $$
+            DECLARE
+                limpio text;
+            BEGIN
+                limpio := lower(translate(coalesce(valor, ''), ',−–', '.--'));
+                limpio := regexp_replace(limpio, '[[:space:]°º]', '', 'g');
+                limpio := regexp_replace(limpio, '^x', '');
+                IF limpio IN ('n', 'neutro', 'pl', 'plano', 'plana', 'esf', 'sph') THEN
+                    RETURN 0;
+                END IF;
+                IF limpio ~ '^[+-]?([0-9]+([.][0-9]*)?|[.][0-9]+)$' THEN
+                    RETURN limpio::numeric;
+                END IF;
+                RETURN NULL;
+            END;
+            $$
+        """)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        campos = {campo for vals in vals_list for campo in vals if campo in self.CAMPOS_REFRACCION}
+        if campos:
+            records._sync_refraccion_num(campos)
+        records.partner_id._programar_estadisticas_consultas()
+        return records
+
+    def write(self, vals):
+        partners = self.partner_id if 'partner_id' in vals or 'fecha' in vals else None
+        if 'fecha' in vals:
+            marcar_pendientes(self)
+        res = super().write(vals)
+        if self.CAMPOS_RECETA.intersection(vals):
+            self._borrar_recetas_pdf()
+        campos = {campo for campo in vals if campo in self.CAMPOS_REFRACCION}
+        if campos:
+            self._sync_refraccion_num(campos)
+        if partners is not None:
+            (partners | self.partner_id)._programar_estadisticas_consultas()
+        return res
+
+    def unlink(self):
+        partners = self.partner_id
+        marcar_pendientes(self)
+        registrar_bajas(self.env, self._table, self.ids)
+        res = super().unlink()
+        partners.exists()._programar_estadisticas_consultas()
+        return res
+
+    def _sync_refraccion_num(self, campos=None):
+        """Actualizar las graduaciones numéricas del lote en una sola sentencia"""
+        if not self.ids:
+            return
+        campos = sorted(campos or self.CAMPOS_REFRACCION)
+        self.flush_recordset(campos)
+        asignaciones = ', '.join(
+            f'"{campo}_num" = optica_parse_graduacion("{campo}")' for campo in campos
+        )
+        self.env.cr.execute(
+            f'UPDATE "{self._table}" SET {asignaciones} WHERE id = ANY(%s)',
+            [self.ids]
+        )
+        self.invalidate_recordset([f'{campo}_num' for campo in campos])
+
+    @api.model
+    def _cron_backfill_refraccion(self, tamano_lote=5000, max_lotes=50):
+        """Rellenar por lotes las graduaciones numéricas desde el texto existente
+
+        Cada lote se confirma por separado y el último id procesado se guarda
+        en un parámetro del sistema, así el relleno se puede interrumpir y
+        reanudar sin repetir trabajo. Cuando no quedan consultas por rellenar
+        el cron se desactiva.
+        """
+        ultimo_id = self._progreso_backfill_refraccion()
+        asignaciones = ', '.join(
+            f'"{campo}_num" = optica_parse_graduacion("{campo}")' for campo in self.CAMPOS_REFRACCION
+        )
+        for _lote in range(max_lotes):
+            self.env.cr.execute(
+                f"""
+                UPDATE "{self._table}" SET {asignaciones}
+                 WHERE id IN (SELECT id FROM "{self._table}" WHERE id > %s ORDER BY id LIMIT %s)
+                RETURNING id
+                """,
+                [ultimo_id, tamano_lote]
+            )
+            ids = [row[0] for row in self.env.cr.fetchall()]
+            if ids:
+                ultimo_id = max(ids)
+                self._guardar_progreso_backfill_refraccion(ultimo_id)
+                self.env.cr.commit()
+                self.invalidate_model([f'{campo}_num' for campo in self.CAMPOS_REFRACCION])
+            if len(ids) < tamano_lote:
+                # Relleno terminado: las consultas nuevas se rellenan en create/write,
+                # así que el cron se desactiva en lugar de seguir corriendo en vacío
+                self.env['ir.cron']._commit_progress(remaining=0, deactivate=True)
+                break
+        return True
+
+    @api.model
+    def _progreso_backfill_refraccion(self):
+        """Último id de consulta con las graduaciones numéricas rellenadas"""
+        return int(leer_parametro(self.env.cr, PARAM_BACKFILL_REFRACCION, 0))
+
+    @api.model
+    def _guardar_progreso_backfill_refraccion(self, ultimo_id):
+        """Guardar el avance del relleno
+
+        Se escribe con SQL y no con set_param, que vaciaría toda la caché del
+        registro en cada lote. El valor forma parte de la firma del historial
+        de refracción (ver res.partner), así solo los historiales memorizados
+        quedan obsoletos.
+        """
+        guardar_parametro(self.env, PARAM_BACKFILL_REFRACCION, ultimo_id)
+
     def action_crear_cita_seguimiento(self):
         self.ensure_one()
         return {
@@ -215,6 +416,58 @@ class OpticaConsulta(models.Model):
             'context': {'default_consulta_id': self.id}
         }
 
+    def _recetas_pdf(self):
+        """Adjuntos con el PDF de la receta ya guardados, por id de consulta
+
+        Solo cuenta el adjunto con el nombre exacto que escribe el reporte; los
+        archivos que el usuario suba a la consulta no se tocan.
+        """
+        adjuntos = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', self.ids),
+            ('name', 'in', [NOMBRE_ADJUNTO_RECETA % consulta_id for consulta_id in self.ids]),
+        ], order='id')
+        recetas = {}
+        for adjunto in adjuntos:
+            if adjunto.name == NOMBRE_ADJUNTO_RECETA % adjunto.res_id:
+                recetas.setdefault(adjunto.res_id, adjunto)
+        return recetas
+
+    def _borrar_recetas_pdf(self):
+        """Borrar el PDF guardado de la receta: se renderiza de nuevo al imprimirla
+
+        Se llama desde write() solo si cambió algún campo de CAMPOS_RECETA.
+        """
+        adjuntos = self._recetas_pdf()
+        if adjuntos:
+            self.env['ir.attachment'].sudo().browse([adjunto.id for adjunto in adjuntos.values()]).unlink()
+
+    def _iterar_recetas_pdf(self, tamano_lote=TAMANO_LOTE_RECETAS):
+        """Generar ``(consulta, stream)`` con el PDF de la receta de cada consulta
+
+        Las recetas ya guardadas se reutilizan; las demás se renderizan en
+        una sola llamada a wkhtmltopdf por lote, y el reporte las guarda como
+        adjunto (attachment_use) para la próxima vez. En memoria solo hay un
+        lote a la vez.
+        """
+        report = self.env.ref('optica_gestion.action_report_receta')
+        for lote in split_every(tamano_lote, self.ids, self.browse):
+            adjuntos = lote._recetas_pdf()
+            faltantes = [consulta_id for consulta_id in lote.ids if consulta_id not in adjuntos]
+            if faltantes:
+                self.env['ir.actions.report']._render_qweb_pdf(report, res_ids=faltantes)
+                adjuntos.update(self.browse(faltantes)._recetas_pdf())
+            for consulta in lote:
+                if consulta.id in adjuntos:
+                    yield consulta, io.BytesIO(adjuntos[consulta.id].raw)
+
+    def action_descargar_recetas_zip(self):
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/optica/recetas/zip?ids=%s' % ','.join(str(consulta_id) for consulta_id in self.ids),
+            'target': 'self',
+        }
+
     def action_eliminar_consulta(self):
         """Eliminar consulta con confirmación"""
         self.ensure_one()
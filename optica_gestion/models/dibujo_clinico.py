@@ -1,4 +1,7 @@
-from odoo import models, fields
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools.image import image_process
+import base64
 
 
 class OpticaDibujoClinico(models.Model):
@@ -24,11 +27,67 @@ class OpticaDibujoClinico(models.Model):
         ('otro', 'Otro')
     ], string='Tipo', default='otro')
     
+    # El original se guarda tal cual (sin reducir y admitiendo PDF)
     imagen = fields.Binary(
         string='Imagen',
         attachment=True
     )
+
+    # Resoluciones derivadas, generadas al subir la imagen. Las vistas cargan
+    # primero la miniatura y la imagen completa solo bajo demanda. Quedan
+    # vacías si el original no es una imagen.
+    imagen_1024 = fields.Image(
+        string='Vista Previa',
+        compute='_compute_imagenes_reducidas',
+        max_width=1024,
+        max_height=1024,
+        store=True
+    )
+
+    imagen_128 = fields.Image(
+        string='Miniatura',
+        compute='_compute_imagenes_reducidas',
+        max_width=128,
+        max_height=128,
+        store=True
+    )
+
+    # Huella del contenido: el filestore ya guarda una sola copia por
+    # checksum, este campo permite localizar dibujos/plantillas idénticos
+    imagen_checksum = fields.Char(
+        string='Checksum',
+        compute='_compute_imagen_checksum',
+        store=True,
+        index=True
+    )
     
     descripcion = fields.Text(
         string='Descripción'
     )
+
+    @api.depends('imagen')
+    def _compute_imagenes_reducidas(self):
+        for record in self:
+            record.imagen_1024 = self._reducir_imagen(record.imagen, 1024)
+            record.imagen_128 = self._reducir_imagen(record.imagen, 128)
+
+    @staticmethod
+    def _reducir_imagen(imagen, lado):
+        """Copia de ``imagen`` (base64) que cabe en ``lado`` x ``lado``, o False si no es una imagen"""
+        if not imagen:
+            return False
+        try:
+            return base64.b64encode(image_process(base64.b64decode(imagen), size=(lado, lado)))
+        except (UserError, ValueError):
+            return False
+
+    @api.depends('imagen')
+    def _compute_imagen_checksum(self):
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', 'in', [rid for rid in self.ids if isinstance(rid, int)]),
+            ('res_field', '=', 'imagen'),
+        ])
+        checksums = {attachment.res_id: attachment.checksum for attachment in attachments}
+        for record in self:
+            record.imagen_checksum = checksums.get(record.id, False)
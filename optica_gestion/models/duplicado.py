@@ -0,0 +1,315 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from .ficha_clinica import CAMPOS_FICHA_BOOLEANOS, CAMPOS_FICHA_TEXTO
+import logging
+import re
+import unicodedata
+
+_logger = logging.getLogger(__name__)
+
+# Partículas que no aportan a la clave fonética del nombre
+PARTICULAS_NOMBRE = {'de', 'del', 'la', 'las', 'los', 'y', 'vda', 'viuda'}
+
+# Reglas fonéticas simplificadas del español, aplicadas en orden
+REGLAS_FONETICAS = [
+    (r'ch', 'x'),
+    (r'll', 'y'),
+    (r'qu', 'k'),
+    (r'c(?=[ei])', 's'),
+    (r'c', 'k'),
+    (r'z', 's'),
+    (r'g(?=[ei])', 'j'),
+    (r'[vw]', 'b'),
+    (r'h', ''),
+    (r'y$', 'i'),
+    (r'(.)\1+', r'\1'),
+]
+
+# Peso de cada coincidencia en el puntaje y puntaje mínimo de un candidato
+PESO_TELEFONO = 0.4
+PESO_NOMBRE = 0.35
+PESO_ANIO = 0.25
+PUNTAJE_MINIMO = 0.6
+
+# Fusiones encadenadas que se siguen como máximo al buscar el superviviente
+MAX_NIVEL_FUSION = 50
+
+
+def clave_fonetica(nombre):
+    """Clave fonética de las dos primeras palabras significativas del nombre"""
+    texto = unicodedata.normalize('NFKD', (nombre or '').lower())
+    texto = ''.join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    palabras = [palabra for palabra in re.findall(r'[a-z]+', texto) if palabra not in PARTICULAS_NOMBRE]
+    claves = []
+    for palabra in palabras[:2]:
+        for patron, reemplazo in REGLAS_FONETICAS:
+            palabra = re.sub(patron, reemplazo, palabra)
+        claves.append(palabra)
+    return ' '.join(claves) or False
+
+
+def telefono_normalizado(telefono):
+    """Últimos 8 dígitos del teléfono (sin prefijo de país ni separadores)"""
+    digitos = re.sub(r'\D', '', telefono or '')
+    return digitos[-8:] if len(digitos) >= 7 else False
+
+
+class OpticaPacienteDuplicado(models.Model):
+    _name = 'optica.paciente.duplicado'
+    _description = 'Posible Paciente Duplicado'
+    _order = 'puntaje desc, id'
+
+    partner_id = fields.Many2one(
+        'res.partner',
+        string='Paciente',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    duplicado_id = fields.Many2one(
+        'res.partner',
+        string='Posible Duplicado',
+        required=True,
+        ondelete='cascade',
+        index=True
+    )
+    puntaje = fields.Float(string='Puntaje', digits=(3, 2), readonly=True)
+    motivo = fields.Char(string='Coincidencias', readonly=True)
+    state = fields.Selection([
+        ('pendiente', 'Pendiente'),
+        ('fusionado', 'Fusionado'),
+        ('descartado', 'Descartado')
+    ], string='Estado', default='pendiente', required=True)
+
+    partner_telefono = fields.Char(related='partner_id.phone', string='Teléfono')
+    duplicado_telefono = fields.Char(related='duplicado_id.phone', string='Teléfono Duplicado')
+    partner_consultas = fields.Integer(related='partner_id.consulta_count', string='Consultas')
+    duplicado_consultas = fields.Integer(related='duplicado_id.consulta_count', string='Consultas Duplicado')
+
+    def init(self):
+        self.env.cr.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS "{self._table}_par_uniq"
+                ON "{self._table}" (partner_id, duplicado_id)
+            """
+        )
+
+    # ==================== DETECCIÓN ====================
+    @api.model
+    def _cron_detectar_duplicados(self, tamano_lote=5000):
+        """Registrar como candidatos los pares de pacientes que comparten bloque
+
+        Solo se comparan pacientes con el mismo teléfono normalizado o la
+        misma clave fonética de nombre, nunca todos contra todos. Los pares ya
+        registrados (incluidos los descartados) se conservan tal cual, así
+        que la detección se puede repetir sin duplicar trabajo.
+        """
+        self.env['res.partner'].flush_model(['dup_telefono', 'dup_nombre', 'dup_anio_nacimiento'])
+        cr = self.env.cr
+        cr.execute("SELECT min(id), max(id) FROM res_partner WHERE is_optica_patient AND active")
+        minimo, maximo = cr.fetchone()
+        if minimo is None:
+            return True
+        total = 0
+        for inicio in range(minimo, maximo + 1, tamano_lote):
+            total += self._detectar_bloque(inicio, inicio + tamano_lote)
+            cr.commit()
+        if total:
+            _logger.info("Duplicados de pacientes: %s candidatos nuevos", total)
+        return True
+
+    def _detectar_bloque(self, desde_id, hasta_id):
+        """Puntuar los pares cuyo paciente más antiguo tiene id en [desde_id, hasta_id)"""
+        self.env.cr.execute(
+            f"""
+            INSERT INTO "{self._table}" (partner_id, duplicado_id, puntaje, motivo, state,
+                                         create_uid, create_date, write_uid, write_date)
+            SELECT a.id, b.id, puntaje, motivo, 'pendiente', %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+              FROM (
+                    SELECT a.id AS a_id, b.id AS b_id
+                      FROM res_partner a
+                      JOIN res_partner b ON b.dup_telefono = a.dup_telefono AND b.id > a.id
+                     WHERE a.id >= %(desde)s AND a.id < %(hasta)s
+                       AND a.is_optica_patient AND a.active AND a.dup_telefono IS NOT NULL
+                       AND b.is_optica_patient AND b.active
+                     UNION
+                    SELECT a.id, b.id
+                      FROM res_partner a
+                      JOIN res_partner b ON b.dup_nombre = a.dup_nombre AND b.id > a.id
+                     WHERE a.id >= %(desde)s AND a.id < %(hasta)s
+                       AND a.is_optica_patient AND a.active AND a.dup_nombre IS NOT NULL
+                       AND b.is_optica_patient AND b.active
+              ) AS par
+              JOIN res_partner a ON a.id = par.a_id
+              JOIN res_partner b ON b.id = par.b_id
+             CROSS JOIN LATERAL (
+                    SELECT a.dup_telefono = b.dup_telefono AS telefono,
+                           a.dup_nombre = b.dup_nombre AS nombre,
+                           abs(a.dup_anio_nacimiento - b.dup_anio_nacimiento) <= 1 AS anio
+             ) AS coincide
+             CROSS JOIN LATERAL (
+                    SELECT CASE WHEN coincide.telefono THEN %(peso_telefono)s ELSE 0 END
+                         + CASE WHEN coincide.nombre THEN %(peso_nombre)s ELSE 0 END
+                         + CASE WHEN coincide.anio THEN %(peso_anio)s ELSE 0 END AS puntaje,
+                           concat_ws(', ',
+                                     CASE WHEN coincide.telefono THEN 'teléfono' END,
+                                     CASE WHEN coincide.nombre THEN 'nombre' END,
+                                     CASE WHEN coincide.anio THEN 'año de nacimiento' END) AS motivo
+             ) AS calculo
+             WHERE puntaje >= %(minimo)s
+            ON CONFLICT (partner_id, duplicado_id) DO NOTHING
+            """,
+            {
+                'uid': self.env.uid,
+                'desde': desde_id,
+                'hasta': hasta_id,
+                'peso_telefono': PESO_TELEFONO,
+                'peso_nombre': PESO_NOMBRE,
+                'peso_anio': PESO_ANIO,
+                'minimo': PUNTAJE_MINIMO,
+            }
+        )
+        return self.env.cr.rowcount
+
+    # ==================== FUSIÓN ====================
+    def _supervivientes(self, partner_ids):
+        """Paciente que conserva los datos de cada uno de ``partner_ids``
+
+        Sigue los pares ya fusionados (duplicado -> paciente) hasta llegar a un
+        contacto que no se fusionó en ningún otro.
+
+        :return: ``{partner_id: superviviente_id}``
+        """
+        self.env.cr.execute(
+            f"""
+            WITH RECURSIVE cadena(origen, actual, nivel) AS (
+                SELECT id, id, 0 FROM unnest(%s::int[]) AS id
+                 UNION ALL
+                SELECT cadena.origen, par.partner_id, cadena.nivel + 1
+                  FROM cadena
+                  JOIN "{self._table}" par ON par.duplicado_id = cadena.actual AND par.state = 'fusionado'
+                 WHERE cadena.nivel < %s
+            )
+            SELECT DISTINCT ON (origen) origen, actual
+              FROM cadena
+          ORDER BY origen, nivel DESC
+            """,
+            [list(partner_ids), MAX_NIVEL_FUSION]
+        )
+        return dict(self.env.cr.fetchall())
+
+    def action_fusionar(self):
+        """Fusionar cada duplicado en su paciente, todo el lote a la vez
+
+        Cada lado del par se resuelve primero a su superviviente (por fusiones
+        anteriores o del mismo lote), y se conserva siempre el más antiguo.
+        Consultas (con sus dibujos), consultas archivadas y citas pasan al
+        paciente conservado con una sentencia por tabla; los duplicados se
+        archivan, se descartan sus otros pares pendientes y se recalculan las
+        estadísticas de ambos lados.
+        """
+        candidatos = self.filtered(lambda candidato: candidato.state == 'pendiente')
+        if not candidatos:
+            raise UserError("No hay candidatos pendientes para fusionar.")
+        self.flush_model(['partner_id', 'duplicado_id', 'state'])
+        supervivientes = self._supervivientes(set(candidatos.partner_id.ids) | set(candidatos.duplicado_id.ids))
+        destino = {}
+
+        def final(partner_id):
+            partner_id = supervivientes[partner_id]
+            while partner_id in destino:
+                partner_id = destino[partner_id]
+            return partner_id
+
+        for candidato in candidatos:
+            paciente, duplicado = final(candidato.partner_id.id), final(candidato.duplicado_id.id)
+            if paciente != duplicado:
+                destino[max(paciente, duplicado)] = min(paciente, duplicado)
+        for origen in destino:
+            destino[origen] = final(origen)
+
+        Partner = self.env['res.partner']
+        archivados = Partner.browse(set(destino.values())).filtered(lambda partner: not partner.active)
+        if archivados:
+            raise UserError(
+                "No se puede fusionar en pacientes archivados: %s" % ', '.join(archivados.mapped('display_name'))
+            )
+        if destino:
+            self._fusionar_pacientes(destino)
+        candidatos.write({'state': 'fusionado'})
+        # Los demás pares de los duplicados ya no tienen sentido: la detección
+        # volverá a proponerlos contra el paciente conservado si corresponde
+        self.search([
+            ('state', '=', 'pendiente'),
+            '|', ('partner_id', 'in', list(destino)), ('duplicado_id', 'in', list(destino)),
+        ]).write({'state': 'descartado'})
+        return True
+
+    def _fusionar_pacientes(self, destino):
+        """Pasar los datos de cada duplicado a su paciente y archivar los duplicados
+
+        :param destino: ``{duplicado_id: paciente_id}``, ya resuelto a supervivientes
+        """
+        origenes, finales = list(destino), list(destino.values())
+        self.env.flush_all()
+        cr = self.env.cr
+        for tabla in ('optica_consulta', 'optica_consulta_archivo', 'optica_cita'):
+            cr.execute(
+                f"""
+                UPDATE "{tabla}" AS t
+                   SET partner_id = m.destino, write_uid = %s, write_date = now() at time zone 'UTC'
+                  FROM unnest(%s::int[], %s::int[]) AS m(origen, destino)
+                 WHERE t.partner_id = m.origen
+                """,
+                [self.env.uid, origenes, finales]
+            )
+        for modelo in ('optica.consulta', 'optica.consulta.archivo', 'optica.cita'):
+            self.env[modelo].invalidate_model(['partner_id', 'write_uid', 'write_date'])
+
+        Partner = self.env['res.partner']
+        duplicados = Partner.browse(origenes)
+        conservados = Partner.browse(set(finales))
+        self._fusionar_fichas(destino)
+        duplicados.write({'active': False})
+        (duplicados | conservados)._actualizar_estadisticas_consultas()
+        for conservado in conservados:
+            nombres = ', '.join(
+                Partner.browse(origen).display_name for origen, final in destino.items() if final == conservado.id
+            )
+            conservado.message_post(body=f"Paciente fusionado con: {nombres}")
+
+    def _fusionar_fichas(self, destino):
+        """Completar la ficha clínica de cada paciente con las de sus duplicados
+
+        Las preguntas marcadas en cualquiera de las fichas quedan marcadas, y
+        las observaciones distintas se añaden a las del paciente conservado.
+        """
+        Partner = self.env['res.partner']
+        por_conservado = {}
+        for origen, final in destino.items():
+            por_conservado.setdefault(final, Partner)
+            por_conservado[final] |= Partner.browse(origen)
+        for conservado_id, duplicados in por_conservado.items():
+            fichas = duplicados.ficha_clinica_id
+            if not fichas:
+                continue
+            conservado = Partner.browse(conservado_id)
+            ficha = conservado.ficha_clinica_id
+            valores = {
+                campo: True for campo in CAMPOS_FICHA_BOOLEANOS
+                if not ficha[campo] and any(fichas.mapped(campo))
+            }
+            for campo in CAMPOS_FICHA_TEXTO:
+                textos = [ficha[campo]] if ficha[campo] else []
+                for texto in fichas.mapped(campo):
+                    if texto and texto.strip() and texto not in textos:
+                        textos.append(texto)
+                if textos and textos != [ficha[campo]]:
+                    valores[campo] = '\n'.join(textos)
+            if valores:
+                conservado.write(valores)
+
+    def action_descartar(self):
+        self.write({'state': 'descartado'})
+        return True
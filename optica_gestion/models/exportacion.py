@@ -0,0 +1,264 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import config
+from .ficha_clinica import CAMPOS_FICHA
+from .importacion_fichas import CAMPOS_BOOLEANOS, CAMPOS_TEXTO
+from datetime import date
+import csv
+import logging
+import os
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+_logger = logging.getLogger(__name__)
+
+# Columnas del paciente, con los mismos nombres que lee la importación de fichas
+COLUMNAS_PACIENTE = CAMPOS_TEXTO + ('fecha', 'edad') + CAMPOS_BOOLEANOS
+
+# Tipos de campo de la consulta que se exportan (los relacionales no)
+TIPOS_EXPORTADOS = {'char', 'text', 'float', 'integer', 'boolean', 'date', 'selection'}
+
+# Filas por hoja de Excel (el límite del formato, menos el encabezado)
+MAX_FILAS_HOJA = 1048575
+
+# Nombre del cursor de servidor con el que se leen los datos
+CURSOR_EXPORTACION = 'optica_exportacion'
+
+
+class OpticaExportacion(models.Model):
+    """Exportación de pacientes y consultas a CSV o Excel en segundo plano
+
+    El cron lee los datos por tramos desde un cursor de servidor y los va
+    escribiendo en un archivo del filestore, así la memoria usada no depende
+    del tamaño de la base. El archivo se descarga por streaming desde
+    /optica/exportacion/<id>.
+    """
+    _name = 'optica.exportacion'
+    _description = 'Exportación de Pacientes y Consultas'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(
+        string='Descripción',
+        required=True,
+        default=lambda self: 'Exportación %s' % fields.Date.today()
+    )
+    formato = fields.Selection([
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel (xlsx)')
+    ], string='Formato', required=True, default='xlsx')
+    incluir_archivadas = fields.Boolean(
+        string='Incluir Consultas Archivadas',
+        default=True
+    )
+    tamano_lote = fields.Integer(
+        string='Tamaño de Lote',
+        default=2000,
+        help='Filas leídas de la base de datos en cada tramo'
+    )
+
+    state = fields.Selection([
+        ('borrador', 'Borrador'),
+        ('en_cola', 'En Cola'),
+        ('en_proceso', 'En Proceso'),
+        ('error', 'Error'),
+        ('hecho', 'Terminada')
+    ], string='Estado', default='borrador', readonly=True, copy=False)
+
+    total_filas = fields.Integer(string='Total de Filas', readonly=True, copy=False)
+    filas = fields.Integer(string='Filas Escritas', readonly=True, copy=False)
+    progreso = fields.Float(string='Progreso', compute='_compute_progreso')
+    archivo_nombre = fields.Char(string='Archivo', compute='_compute_archivo_nombre')
+    log = fields.Text(string='Registro', readonly=True, copy=False)
+
+    @api.depends('total_filas', 'filas')
+    def _compute_progreso(self):
+        for record in self:
+            if record.total_filas:
+                record.progreso = min(100.0, 100.0 * record.filas / record.total_filas)
+            else:
+                record.progreso = 0.0
+
+    @api.depends('name', 'formato')
+    def _compute_archivo_nombre(self):
+        for record in self:
+            record.archivo_nombre = f'{record.name or "exportacion"}.{record.formato}'
+
+    def unlink(self):
+        rutas = [record._ruta_archivo() for record in self]
+        res = super().unlink()
+        for ruta in rutas:
+            if os.path.exists(ruta):
+                os.unlink(ruta)
+        return res
+
+    def action_exportar(self):
+        """Encolar la exportación; el cron la procesa en segundo plano"""
+        if 'xlsx' in self.mapped('formato') and xlsxwriter is None:
+            raise UserError("La librería xlsxwriter no está instalada en el servidor.")
+        # El cron lee con SQL directo: se exige aquí el acceso de quien exporta
+        self.env['res.partner'].check_access('read')
+        self.env['optica.consulta'].check_access('read')
+        self.write({'state': 'en_cola', 'filas': 0, 'log': False})
+        self.env.ref('optica_gestion.ir_cron_exportacion')._trigger()
+        return True
+
+    def action_descargar(self):
+        self.ensure_one()
+        if self.state != 'hecho':
+            raise UserError("La exportación todavía no ha terminado.")
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/optica/exportacion/{self.id}',
+            'target': 'self',
+        }
+
+    @api.model
+    def _cron_procesar_exportaciones(self):
+        # Una exportación que sigue en proceso al empezar el cron se cortó (por
+        # ejemplo por el límite de tiempo): reiniciarla volvería a cortarse
+        interrumpidas = self.search([('state', '=', 'en_proceso')])
+        if interrumpidas:
+            interrumpidas.write({
+                'state': 'error',
+                'log': "Error: la exportación se interrumpió antes de terminar "
+                       "(por ejemplo, por el límite de tiempo de los cron).",
+            })
+            self.env.cr.commit()
+        for exportacion in self.search([('state', '=', 'en_cola')]):
+            exportacion._procesar()
+
+    def _ruta_archivo(self):
+        """Ruta del archivo generado dentro del filestore de la base de datos"""
+        self.ensure_one()
+        carpeta = os.path.join(config.filestore(self.env.cr.dbname), 'optica_exportaciones')
+        return os.path.join(carpeta, f'{self.id}.{self.formato}')
+
+    # ==================== CONSULTA ====================
+    def _columnas_consulta(self):
+        Consulta = self.env['optica.consulta']
+        return [
+            nombre for nombre, campo in Consulta._fields.items()
+            if campo.store and campo.column_type and not campo.compute
+            and campo.type in TIPOS_EXPORTADOS and nombre != 'id'
+        ]
+
+    def _origen_consultas(self, columnas):
+        """Consultas activas y, si se piden, archivadas, con las ``columnas`` indicadas"""
+        lista = ', '.join(f'"{columna}"' for columna in columnas)
+        sql = f'SELECT {lista} FROM optica_consulta'
+        if self.incluir_archivadas:
+            sql += f' UNION ALL SELECT {lista} FROM optica_consulta_archivo'
+        return sql
+
+    def _consulta_exportacion(self):
+        """SELECT de una fila por consulta (o por paciente sin consultas) y sus encabezados"""
+        columnas_consulta = ['id'] + self._columnas_consulta()
+        seleccion = [
+            f'f."{columna}"' if columna in CAMPOS_FICHA else f'p."{columna}"'
+            for columna in COLUMNAS_PACIENTE
+        ] + [f'c."{columna}"' for columna in columnas_consulta]
+        sql = f"""
+            SELECT {', '.join(seleccion)}
+              FROM res_partner p
+         LEFT JOIN optica_ficha_clinica f ON f.id = p.ficha_clinica_id
+         LEFT JOIN ({self._origen_consultas(['partner_id'] + columnas_consulta)}) AS c ON c.partner_id = p.id
+             WHERE p.is_optica_patient AND p.active
+          ORDER BY p.id, c.fecha, c.id
+        """
+        encabezados = list(COLUMNAS_PACIENTE) + [f'consulta_{columna}' for columna in columnas_consulta]
+        return sql, encabezados
+
+    def _contar_filas(self, cr):
+        cr.execute(
+            f"""
+            SELECT count(*)
+              FROM res_partner p
+         LEFT JOIN ({self._origen_consultas(['partner_id'])}) AS c ON c.partner_id = p.id
+             WHERE p.is_optica_patient AND p.active
+            """
+        )
+        return cr.fetchone()[0]
+
+    @staticmethod
+    def _formatear(valor):
+        """Valor de celda en el formato que espera la importación de fichas"""
+        if valor is None:
+            return ''
+        if isinstance(valor, bool):
+            return int(valor)
+        if isinstance(valor, date):
+            return valor.strftime('%d/%m/%Y')
+        return valor
+
+    # ==================== PROCESO ====================
+    def _procesar(self):
+        """Escribir el archivo por tramos leídos desde un cursor de servidor
+
+        La lectura se hace en una transacción aparte (una sola instantánea de
+        los datos); la transacción principal solo confirma el avance.
+        """
+        self.ensure_one()
+        self.write({'state': 'en_proceso', 'filas': 0})
+        self.env.cr.commit()
+        ruta = self._ruta_archivo()
+        parcial = ruta + '.parcial'
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            sql, encabezados = self._consulta_exportacion()
+            with self.env.registry.cursor() as cr_lectura:
+                self.total_filas = self._contar_filas(cr_lectura)
+                self.env.cr.commit()
+                cr_lectura.execute(f"DECLARE {CURSOR_EXPORTACION} NO SCROLL CURSOR FOR {sql}")
+                escribir = self._escribir_csv if self.formato == 'csv' else self._escribir_xlsx
+                escribir(parcial, encabezados, self._tramos(cr_lectura))
+                cr_lectura.execute(f"CLOSE {CURSOR_EXPORTACION}")
+            os.replace(parcial, ruta)
+            self.write({'state': 'hecho'})
+            self.env.cr.commit()
+        except Exception as e:
+            _logger.exception("Error en la exportación %s", self.id)
+            self.env.cr.rollback()
+            if os.path.exists(parcial):
+                os.unlink(parcial)
+            self.write({'state': 'error', 'log': "Error: %s" % e})
+            self.env.cr.commit()
+
+    def _tramos(self, cr_lectura):
+        """Tramos de filas del cursor de servidor; confirma el avance tras cada uno"""
+        while True:
+            cr_lectura.execute(f"FETCH FORWARD %s FROM {CURSOR_EXPORTACION}", [self.tamano_lote or 2000])
+            filas = cr_lectura.fetchall()
+            if not filas:
+                return
+            yield filas
+            self.filas += len(filas)
+            self.env.cr.commit()
+
+    def _escribir_csv(self, ruta, encabezados, tramos):
+        # utf-8-sig para que Excel reconozca los acentos al abrir el CSV
+        with open(ruta, 'w', newline='', encoding='utf-8-sig') as archivo:
+            escritor = csv.writer(archivo)
+            escritor.writerow(encabezados)
+            for filas in tramos:
+                escritor.writerows([self._formatear(valor) for valor in fila] for fila in filas)
+
+    def _escribir_xlsx(self, ruta, encabezados, tramos):
+        # constant_memory escribe cada fila al disco en cuanto se pasa a la siguiente
+        libro = xlsxwriter.Workbook(ruta, {'constant_memory': True})
+        try:
+            hoja, numero = None, MAX_FILAS_HOJA
+            for filas in tramos:
+                for fila in filas:
+                    if numero >= MAX_FILAS_HOJA:
+                        hoja = libro.add_worksheet()
+                        hoja.write_row(0, 0, encabezados)
+                        numero = 0
+                    numero += 1
+                    hoja.write_row(numero, 0, [self._formatear(valor) for valor in fila])
+            if hoja is None:
+                libro.add_worksheet().write_row(0, 0, encabezados)
+        finally:
+            libro.close()
@@ -0,0 +1,99 @@
+from odoo import models, fields
+
+# Preguntas y síntomas de la ficha
+CAMPOS_FICHA_BOOLEANOS = (
+    'ev_visual', 'enfermedad', 'computadora', 'lentes', 'antecedentes',
+    'cefalea', 'vision_borrosa', 'dolor', 'ojo_rojo', 'fotofobia', 'glaucoma',
+    'diabetes', 'secreciones', 'cansancio', 'volantes', 'ardor', 'embarazo',
+    'presion', 'cx', 'otros',
+)
+
+# Observaciones de las preguntas y observaciones clínicas generales
+CAMPOS_FICHA_TEXTO = (
+    'ob_ev_visual', 'ob_enfermedad', 'ob_computadora', 'ob_lentes', 'ob_antecedentes',
+    'anexos_oculares', 'fondo_ojo', 'observaciones',
+)
+
+CAMPOS_FICHA = CAMPOS_FICHA_BOOLEANOS + CAMPOS_FICHA_TEXTO
+
+
+class OpticaFichaClinica(models.Model):
+    """Cuestionario clínico del paciente, uno por contacto
+
+    Vive fuera de res_partner para que los contactos que no son pacientes
+    (clientes, proveedores, empresas) no carguen con sus columnas. El
+    contacto expone los mismos campos como relacionados editables.
+    """
+    _name = 'optica.ficha.clinica'
+    _description = 'Ficha Clínica del Paciente'
+    _rec_name = 'partner_id'
+
+    partner_id = fields.Many2one(
+        'res.partner',
+        string='Paciente',
+        required=True,
+        ondelete='cascade'
+    )
+
+    # Preguntas de la ficha (Boolean para coincidir con Excel 0/1)
+    ev_visual = fields.Boolean(
+        string='Se ha realizado alguna evaluación visual'
+    )
+    ob_ev_visual = fields.Text(
+        string='Observaciones Evaluación Visual'
+    )
+
+    enfermedad = fields.Boolean(
+        string='Padece de alguna enfermedad'
+    )
+    ob_enfermedad = fields.Text(
+        string='Observaciones Enfermedad'
+    )
+
+    computadora = fields.Boolean(
+        string='Usa computadora'
+    )
+    ob_computadora = fields.Text(
+        string='Observaciones Computadora'
+    )
+
+    lentes = fields.Boolean(
+        string='Ha usado lentes'
+    )
+    ob_lentes = fields.Text(
+        string='Observaciones Lentes'
+    )
+
+    antecedentes = fields.Boolean(
+        string='Antecedentes familiares'
+    )
+    ob_antecedentes = fields.Text(
+        string='Observaciones Antecedentes'
+    )
+
+    # SÍNTOMAS (nombres exactos del Excel)
+    cefalea = fields.Boolean(string='Cefalea')
+    vision_borrosa = fields.Boolean(string='Visión Borrosa')
+    dolor = fields.Boolean(string='Dolor')
+    ojo_rojo = fields.Boolean(string='Ojo Rojo')
+    fotofobia = fields.Boolean(string='Fotofobia')
+    glaucoma = fields.Boolean(string='Glaucoma')
+    diabetes = fields.Boolean(string='Diabetes')
+    secreciones = fields.Boolean(string='Secreciones')
+    cansancio = fields.Boolean(string='Cansancio')
+    volantes = fields.Boolean(string='M. Volantes')
+    ardor = fields.Boolean(string='Ardor')
+    embarazo = fields.Boolean(string='Embarazo')
+    presion = fields.Boolean(string='Presión')
+    cx = fields.Boolean(string='CX')
+    otros = fields.Boolean(string='Otros')
+
+    # Observaciones clínicas generales (del Excel)
+    anexos_oculares = fields.Text(string='Anexos Oculares')
+    fondo_ojo = fields.Text(string='Fondo de Ojo')
+    observaciones = fields.Text(string='Observaciones')
+
+    def init(self):
+        self.env.cr.execute(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS "{self._table}_partner_uniq" ON "{self._table}" (partner_id)'
+        )
@@ -0,0 +1,290 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from .ficha_clinica import CAMPOS_FICHA_BOOLEANOS, CAMPOS_FICHA_TEXTO
+from datetime import date, datetime
+import io
+import logging
+import unicodedata
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+_logger = logging.getLogger(__name__)
+
+# Preguntas y síntomas de la ficha (0/1 en el Excel)
+CAMPOS_BOOLEANOS = CAMPOS_FICHA_BOOLEANOS
+
+# Datos del contacto seguidos de las observaciones de la ficha
+CAMPOS_TEXTO = (
+    'name', 'phone', 'email', 'ficha_numero', 'direccion_paciente', 'ocupacion',
+    'referencia',
+) + CAMPOS_FICHA_TEXTO
+
+# Encabezados del Excel que no coinciden con el nombre del campo
+ALIAS_ENCABEZADOS = {
+    'nombre': 'name',
+    'paciente': 'name',
+    'telefono': 'phone',
+    'tel': 'phone',
+    'correo': 'email',
+    'ficha': 'ficha_numero',
+    'ficha_no': 'ficha_numero',
+    'no_ficha': 'ficha_numero',
+    'direccion': 'direccion_paciente',
+    'm_volantes': 'volantes',
+}
+
+VALORES_VERDADEROS = {'1', 'si', 's', 'x', 'true', 'verdadero'}
+VALORES_FALSOS = {'', '0', 'no', 'n', 'false', 'falso'}
+
+# Máximo de líneas de errores guardadas en el registro de la importación
+MAX_LINEAS_LOG = 200
+
+
+def _normalizar_encabezado(valor):
+    texto = unicodedata.normalize('NFKD', str(valor or '')).encode('ascii', 'ignore').decode()
+    texto = texto.strip().lower().replace('.', ' ').replace('/', ' ')
+    return '_'.join(texto.split())
+
+
+class OpticaImportacionFichas(models.Model):
+    _name = 'optica.importacion.fichas'
+    _description = 'Importación de Fichas de Pacientes'
+    _order = 'create_date desc, id desc'
+
+    name = fields.Char(
+        string='Descripción',
+        required=True,
+        default=lambda self: 'Importación %s' % fields.Date.today()
+    )
+
+    archivo = fields.Binary(
+        string='Archivo Excel',
+        required=True,
+        attachment=True
+    )
+    archivo_nombre = fields.Char(string='Nombre del Archivo')
+
+    tamano_lote = fields.Integer(
+        string='Tamaño de Lote',
+        default=500,
+        help='Pacientes creados y confirmados en cada lote'
+    )
+
+    state = fields.Selection([
+        ('borrador', 'Borrador'),
+        ('en_cola', 'En Cola'),
+        ('en_proceso', 'En Proceso'),
+        ('error', 'Error'),
+        ('hecho', 'Terminada')
+    ], string='Estado', default='borrador', readonly=True, copy=False)
+
+    total_filas = fields.Integer(string='Total de Filas', readonly=True, copy=False)
+    ultima_fila = fields.Integer(
+        string='Última Fila Procesada',
+        readonly=True,
+        copy=False,
+        help='Fila del Excel (contando el encabezado) hasta la que se ha confirmado la importación'
+    )
+    creados = fields.Integer(string='Pacientes Creados', readonly=True, copy=False)
+    omitidos = fields.Integer(string='Filas Omitidas', readonly=True, copy=False)
+    progreso = fields.Float(string='Progreso', compute='_compute_progreso')
+    log = fields.Text(string='Registro', readonly=True, copy=False)
+
+    @api.depends('total_filas', 'ultima_fila')
+    def _compute_progreso(self):
+        for record in self:
+            if record.total_filas:
+                record.progreso = min(100.0, 100.0 * max(record.ultima_fila - 1, 0) / record.total_filas)
+            else:
+                record.progreso = 0.0
+
+    def action_importar(self):
+        """Encolar la importación; el cron la procesa en segundo plano"""
+        if openpyxl is None:
+            raise UserError("La librería openpyxl no está instalada en el servidor.")
+        self.write({'state': 'en_cola'})
+        self.env.ref('optica_gestion.ir_cron_importacion_fichas')._trigger()
+        return True
+
+    def action_reanudar(self):
+        """Continuar desde la última fila confirmada"""
+        return self.action_importar()
+
+    @api.model
+    def _cron_procesar_importaciones(self):
+        for importacion in self.search([('state', 'in', ('en_cola', 'en_proceso'))]):
+            importacion._procesar()
+
+    def _abrir_hoja(self):
+        """Abrir el libro en modo lectura (streaming) directamente desde el filestore"""
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_id', '=', self.id),
+            ('res_field', '=', 'archivo'),
+        ], limit=1)
+        if not attachment:
+            raise UserError("No se encontró el archivo de la importación.")
+        if attachment.store_fname:
+            origen = attachment._full_path(attachment.store_fname)
+        else:
+            origen = io.BytesIO(attachment.raw)
+        libro = openpyxl.load_workbook(origen, read_only=True, data_only=True)
+        return libro, libro.worksheets[0]
+
+    def _mapear_encabezados(self, encabezados):
+        partner_fields = self.env['res.partner']._fields
+        columnas = {}
+        for indice, encabezado in enumerate(encabezados):
+            nombre = _normalizar_encabezado(encabezado)
+            campo = ALIAS_ENCABEZADOS.get(nombre, nombre)
+            if campo in partner_fields and (campo in CAMPOS_BOOLEANOS or campo in CAMPOS_TEXTO or campo in ('fecha', 'edad')):
+                columnas[indice] = campo
+        if 'name' not in columnas.values():
+            raise UserError("El archivo no tiene una columna de nombre del paciente.")
+        return columnas
+
+    def _preparar_valores(self, columnas, fila):
+        """Convertir una fila del Excel en valores de res.partner
+
+        :raise ValueError: si algún valor no es válido
+        """
+        vals = {'is_optica_patient': True}
+        for indice, campo in columnas.items():
+            valor = fila[indice] if indice < len(fila) else None
+            if campo in CAMPOS_BOOLEANOS:
+                texto = _normalizar_encabezado(valor)
+                if isinstance(valor, (int, float)) and valor in (0, 1):
+                    vals[campo] = bool(valor)
+                elif texto in VALORES_VERDADEROS:
+                    vals[campo] = True
+                elif texto in VALORES_FALSOS:
+                    vals[campo] = False
+                else:
+                    raise ValueError("valor '%s' no válido para %s" % (valor, campo))
+            elif campo == 'edad':
+                if valor not in (None, ''):
+                    vals[campo] = int(float(valor))
+            elif campo == 'fecha':
+                if isinstance(valor, datetime):
+                    vals[campo] = valor.date()
+                elif isinstance(valor, date):
+                    vals[campo] = valor
+                elif valor not in (None, ''):
+                    vals[campo] = datetime.strptime(str(valor).strip(), '%d/%m/%Y').date()
+            elif valor not in (None, ''):
+                if isinstance(valor, float) and valor.is_integer():
+                    valor = int(valor)
+                vals[campo] = str(valor).strip()
+        if not vals.get('name'):
+            raise ValueError("falta el nombre del paciente")
+        return vals
+
+    def _procesar(self):
+        """Importar por lotes confirmando cada uno; se puede reanudar tras un fallo"""
+        self.ensure_one()
+        self.write({'state': 'en_proceso'})
+        self.env.cr.commit()
+        errores = []
+        try:
+            libro, hoja = self._abrir_hoja()
+            try:
+                encabezados = next(hoja.iter_rows(min_row=1, max_row=1, values_only=True), ())
+                columnas = self._mapear_encabezados(encabezados)
+                if not self.total_filas:
+                    self.total_filas = max((hoja.max_row or 1) - 1, 0)
+                inicio = max(self.ultima_fila, 1) + 1
+                numero = inicio - 1
+                lote = []
+                # Las filas no válidas se cuentan y registran junto con su lote
+                invalidas = 0
+                for numero, fila in enumerate(hoja.iter_rows(min_row=inicio, values_only=True), start=inicio):
+                    if not any(valor not in (None, '') for valor in fila):
+                        continue
+                    try:
+                        lote.append((numero, self._preparar_valores(columnas, fila)))
+                    except (ValueError, TypeError) as e:
+                        errores.append("Fila %s: %s" % (numero, e))
+                        invalidas += 1
+                    if len(lote) >= self.tamano_lote:
+                        self._crear_lote(lote, numero, errores, invalidas)
+                        lote = []
+                        errores = []
+                        invalidas = 0
+                self._crear_lote(lote, numero, errores, invalidas)
+                errores = []
+            finally:
+                libro.close()
+            self.write({'state': 'hecho'})
+            self.env.cr.commit()
+        except Exception as e:
+            _logger.exception("Error en la importación de fichas %s", self.id)
+            self.env.cr.rollback()
+            errores.append("Error: %s" % e)
+            self.write({'state': 'error'})
+            self._agregar_log(errores)
+            self.env.cr.commit()
+
+    def _crear_lote(self, lote, ultima_fila, errores, invalidas=0):
+        """Crear un lote de pacientes y confirmar el avance
+
+        :param errores: líneas de log acumuladas desde el lote anterior
+        :param invalidas: filas omitidas por valores no válidos desde el lote anterior
+        """
+        vals_list = [vals for _numero, vals in lote]
+        # Las fichas que ya existen (p. ej. al reanudar) no se vuelven a crear
+        fichas = [vals['ficha_numero'] for vals in vals_list if vals.get('ficha_numero')]
+        existentes = set()
+        if fichas:
+            existentes = set(self.env['res.partner'].with_context(active_test=False).search([
+                ('ficha_numero', 'in', fichas),
+            ]).mapped('ficha_numero'))
+        nuevos = []
+        for numero, vals in lote:
+            ficha = vals.get('ficha_numero')
+            if ficha in existentes:
+                errores.append("Fila %s: la ficha %s ya existe" % (numero, ficha))
+            else:
+                # Una ficha repetida dentro del mismo archivo se importa solo la primera vez
+                if ficha:
+                    existentes.add(ficha)
+                nuevos.append((numero, vals))
+
+        Partner = self.env['res.partner'].with_context(
+            tracking_disable=True,
+            mail_create_nolog=True,
+            optica_diferir_estadisticas=True,
+        )
+        creados = 0
+        try:
+            with self.env.cr.savepoint():
+                Partner.create([vals for _numero, vals in nuevos])
+                creados = len(nuevos)
+        except Exception:
+            # Aislar las filas problemáticas creándolas una a una
+            for numero, vals in nuevos:
+                try:
+                    with self.env.cr.savepoint():
+                        Partner.create([vals])
+                        creados += 1
+                except Exception as e:
+                    errores.append("Fila %s: %s" % (numero, e))
+
+        self.write({
+            'ultima_fila': ultima_fila,
+            'creados': self.creados + creados,
+            'omitidos': self.omitidos + invalidas + len(lote) - creados,
+        })
+        self._agregar_log(errores)
+        self.env.cr.commit()
+
+    def _agregar_log(self, lineas):
+        if not lineas:
+            return
+        actuales = (self.log or '').splitlines()
+        if len(actuales) >= MAX_LINEAS_LOG:
+            return
+        self.log = '\n'.join(actuales + lineas[:MAX_LINEAS_LOG - len(actuales)])
@@ -0,0 +1,119 @@
+# Índices de los caminos de acceso del módulo. Cada modelo declara en
+# _optica_indices una lista de (sufijo, definición) y los crea desde init();
+# el índice se llama <tabla>_<sufijo>. verificar_indices(env) se ejecuta al
+# instalar el módulo, cada semana desde un cron y a pedido desde el menú de
+# configuración (modelo optica.indices).
+from odoo import models, api
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Modelos que declaran índices propios
+MODELOS_CON_INDICES = ('res.partner', 'optica.consulta', 'optica.consulta.archivo', 'optica.cita')
+
+# Un índice B-tree se considera hinchado si ocupa más de FACTOR_HINCHADO
+# veces su tamaño estimado y supera TAMANO_MINIMO_HINCHADO bytes
+FACTOR_HINCHADO = 2.0
+TAMANO_MINIMO_HINCHADO = 1024 * 1024
+
+
+def nombre_indice(tabla, sufijo):
+    return f'{tabla}_{sufijo}'
+
+
+def crear_indices(cr, tabla, indices):
+    """Crear los índices que falten en ``tabla``"""
+    for sufijo, definicion in indices:
+        cr.execute(
+            f'CREATE INDEX IF NOT EXISTS "{nombre_indice(tabla, sufijo)}" ON "{tabla}" {definicion}'
+        )
+
+
+def revisar_indices(cr, tabla, indices):
+    """Revisar los índices de ``tabla``
+
+    :return: lista de problemas encontrados (índices ausentes, inválidos o
+        hinchados), vacía si todo está en orden
+    """
+    nombres = [nombre_indice(tabla, sufijo) for sufijo, _definicion in indices]
+    cr.execute(
+        """
+        SELECT idx.relname,
+               i.indisvalid,
+               am.amname,
+               pg_relation_size(idx.oid) AS tamano,
+               GREATEST(idx.reltuples, 0) AS entradas,
+               COALESCE((
+                    SELECT sum(s.avg_width)
+                      FROM pg_attribute a
+                      JOIN pg_stats s ON s.tablename = tbl.relname
+                                     AND s.attname = a.attname
+                                     AND s.schemaname = current_schema()
+                     WHERE a.attrelid = tbl.oid
+                       AND a.attnum = ANY(i.indkey)
+               ), 8) AS ancho
+          FROM pg_class idx
+          JOIN pg_index i ON i.indexrelid = idx.oid
+          JOIN pg_class tbl ON tbl.oid = i.indrelid
+          JOIN pg_am am ON am.oid = idx.relam
+         WHERE idx.relname = ANY(%s)
+        """,
+        [nombres]
+    )
+    encontrados = {row[0]: row[1:] for row in cr.fetchall()}
+    problemas = []
+    for nombre in nombres:
+        if nombre not in encontrados:
+            problemas.append(f"{tabla}: falta el índice {nombre}")
+            continue
+        valido, metodo, tamano, entradas, ancho = encontrados[nombre]
+        if not valido:
+            problemas.append(f"{tabla}: el índice {nombre} no es válido (reconstruir con REINDEX)")
+        elif metodo == 'btree':
+            # Cada entrada ocupa la clave, la cabecera de tupla (8) y el puntero (4),
+            # con un relleno de página del 90 %, más la metapágina y la raíz
+            estimado = entradas * (float(ancho) + 12) / 0.9 + 2 * 8192
+            if tamano > TAMANO_MINIMO_HINCHADO and tamano > FACTOR_HINCHADO * estimado:
+                problemas.append(
+                    f"{tabla}: el índice {nombre} parece hinchado "
+                    f"({tamano // 1024} kB, estimado {int(estimado) // 1024} kB)"
+                )
+    return problemas
+
+
+def verificar_indices(env):
+    """Revisar los índices de todos los modelos del módulo y registrar los problemas"""
+    problemas = []
+    for modelo in MODELOS_CON_INDICES:
+        model = env[modelo]
+        problemas += revisar_indices(env.cr, model._table, model._optica_indices)
+    for problema in problemas:
+        _logger.warning("Índices de óptica: %s", problema)
+    if not problemas:
+        _logger.info("Índices de óptica: todos presentes y en buen estado")
+    return problemas
+
+
+class OpticaIndices(models.AbstractModel):
+    _name = 'optica.indices'
+    _description = 'Revisión de Índices de Óptica'
+
+    @api.model
+    def _cron_verificar_indices(self):
+        verificar_indices(self.env)
+        return True
+
+    @api.model
+    def action_verificar_indices(self):
+        """Revisar los índices y mostrar el resultado en una notificación"""
+        problemas = verificar_indices(self.env)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': "Índices de óptica",
+                'message': '\n'.join(problemas) or "Todos los índices están presentes y en buen estado.",
+                'type': 'warning' if problemas else 'success',
+                'sticky': bool(problemas),
+            },
+        }
@@ -0,0 +1,23 @@
+# Marcas de avance de los cron guardadas en ir_config_parameter. Se leen y
+# escriben con SQL y no con get_param/set_param: set_param vacía la caché del
+# registro en todos los workers, y estas marcas cambian en cada lote.
+
+
+def leer_parametro(cr, clave, defecto=None):
+    """Valor actual de ``clave`` en ir_config_parameter, sin pasar por la caché"""
+    cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", [clave])
+    fila = cr.fetchone()
+    return fila[0] if fila else defecto
+
+
+def guardar_parametro(env, clave, valor):
+    """Crear o actualizar ``clave`` en ir_config_parameter con una sola sentencia"""
+    env.cr.execute(
+        """
+        INSERT INTO ir_config_parameter (key, value, create_uid, create_date, write_uid, write_date)
+        VALUES (%s, %s, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC')
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, write_uid = EXCLUDED.write_uid,
+                                        write_date = EXCLUDED.write_date
+        """,
+        [clave, str(valor), env.uid, env.uid]
+    )
@@ -1,4 +1,29 @@
 from odoo import models, fields, api
+from dateutil.relativedelta import relativedelta
+from odoo.tools import SQL, ormcache
+from odoo.tools.sql import escape_psql
+from .indices import crear_indices
+from .duplicado import clave_fonetica, telefono_normalizado
+from .ficha_clinica import CAMPOS_FICHA
+from .consulta import PARAM_BACKFILL_REFRACCION
+from .sync_baja import registrar_bajas
+from .parametros import leer_parametro, guardar_parametro
+import logging
+import psycopg2
+import re
+
+_logger = logging.getLogger(__name__)
+
+# Columnas de la búsqueda rápida de pacientes (índices trigram parciales)
+COLUMNAS_BUSQUEDA_PACIENTE = ('name', 'phone', 'ficha_numero')
+
+# Textos que pueden ser un nombre, un teléfono o un número de ficha; el resto
+# (correos, NIF con barras, etc.) se busca con el name_search estándar
+PATRON_BUSQUEDA_PACIENTE = re.compile(r"^[\w\s.,'()+-]+$")
+
+# Marca de avance del motor de recordatorios: fecha de la corrida y último paciente procesado
+PARAM_RECORDATORIO_FECHA = 'optica_gestion.recordatorio_fecha'
+PARAM_RECORDATORIO_ID = 'optica_gestion.recordatorio_ultimo_id'
 
 
 class ResPartner(models.Model):
@@ -51,63 +76,46 @@ class ResPartner(models.Model):
         help='¿Cómo se enteró de nosotros?'
     )
 
-    # Preguntas de la ficha (Boolean para coincidir con Excel 0/1)
-    ev_visual = fields.Boolean(
-        string='Se ha realizado alguna evaluación visual'
-    )
-    ob_ev_visual = fields.Text(
-        string='Observaciones Evaluación Visual'
-    )
-
-    enfermedad = fields.Boolean(
-        string='Padece de alguna enfermedad'
-    )
-    ob_enfermedad = fields.Text(
-        string='Observaciones Enfermedad'
-    )
-
-    computadora = fields.Boolean(
-        string='Usa computadora'
-    )
-    ob_computadora = fields.Text(
-        string='Observaciones Computadora'
-    )
-
-    lentes = fields.Boolean(
-        string='Ha usado lentes'
-    )
-    ob_lentes = fields.Text(
-        string='Observaciones Lentes'
+    # Cuestionario clínico, guardado en optica.ficha.clinica y expuesto aquí
+    # como campos relacionados editables
+    ficha_clinica_id = fields.Many2one(
+        'optica.ficha.clinica',
+        string='Ficha Clínica',
+        ondelete='set null',
+        copy=False,
+        index='btree_not_null'
     )
 
-    antecedentes = fields.Boolean(
-        string='Antecedentes familiares'
-    )
-    ob_antecedentes = fields.Text(
-        string='Observaciones Antecedentes'
-    )
+    ev_visual = fields.Boolean(related='ficha_clinica_id.ev_visual', readonly=False)
+    ob_ev_visual = fields.Text(related='ficha_clinica_id.ob_ev_visual', readonly=False)
+    enfermedad = fields.Boolean(related='ficha_clinica_id.enfermedad', readonly=False)
+    ob_enfermedad = fields.Text(related='ficha_clinica_id.ob_enfermedad', readonly=False)
+    computadora = fields.Boolean(related='ficha_clinica_id.computadora', readonly=False)
+    ob_computadora = fields.Text(related='ficha_clinica_id.ob_computadora', readonly=False)
+    lentes = fields.Boolean(related='ficha_clinica_id.lentes', readonly=False)
+    ob_lentes = fields.Text(related='ficha_clinica_id.ob_lentes', readonly=False)
+    antecedentes = fields.Boolean(related='ficha_clinica_id.antecedentes', readonly=False)
+    ob_antecedentes = fields.Text(related='ficha_clinica_id.ob_antecedentes', readonly=False)
 
-    # SÍNTOMAS (nombres exactos del Excel)
-    cefalea = fields.Boolean(string='Cefalea')
-    vision_borrosa = fields.Boolean(string='Visión Borrosa')
-    dolor = fields.Boolean(string='Dolor')
-    ojo_rojo = fields.Boolean(string='Ojo Rojo')
-    fotofobia = fields.Boolean(string='Fotofobia')
-    glaucoma = fields.Boolean(string='Glaucoma')
-    diabetes = fields.Boolean(string='Diabetes')
-    secreciones = fields.Boolean(string='Secreciones')
-    cansancio = fields.Boolean(string='Cansancio')
-    volantes = fields.Boolean(string='M. Volantes')
-    ardor = fields.Boolean(string='Ardor')
-    embarazo = fields.Boolean(string='Embarazo')
-    presion = fields.Boolean(string='Presión')
-    cx = fields.Boolean(string='CX')
-    otros = fields.Boolean(string='Otros')
+    cefalea = fields.Boolean(related='ficha_clinica_id.cefalea', readonly=False)
+    vision_borrosa = fields.Boolean(related='ficha_clinica_id.vision_borrosa', readonly=False)
+    dolor = fields.Boolean(related='ficha_clinica_id.dolor', readonly=False)
+    ojo_rojo = fields.Boolean(related='ficha_clinica_id.ojo_rojo', readonly=False)
+    fotofobia = fields.Boolean(related='ficha_clinica_id.fotofobia', readonly=False)
+    glaucoma = fields.Boolean(related='ficha_clinica_id.glaucoma', readonly=False)
+    diabetes = fields.Boolean(related='ficha_clinica_id.diabetes', readonly=False)
+    secreciones = fields.Boolean(related='ficha_clinica_id.secreciones', readonly=False)
+    cansancio = fields.Boolean(related='ficha_clinica_id.cansancio', readonly=False)
+    volantes = fields.Boolean(related='ficha_clinica_id.volantes', readonly=False)
+    ardor = fields.Boolean(related='ficha_clinica_id.ardor', readonly=False)
+    embarazo = fields.Boolean(related='ficha_clinica_id.embarazo', readonly=False)
+    presion = fields.Boolean(related='ficha_clinica_id.presion', readonly=False)
+    cx = fields.Boolean(related='ficha_clinica_id.cx', readonly=False)
+    otros = fields.Boolean(related='ficha_clinica_id.otros', readonly=False)
 
-    # Observaciones clínicas generales (del Excel)
-    anexos_oculares = fields.Text(string='Anexos Oculares')
-    fondo_ojo = fields.Text(string='Fondo de Ojo')
-    observaciones = fields.Text(string='Observaciones')
+    anexos_oculares = fields.Text(related='ficha_clinica_id.anexos_oculares', readonly=False)
+    fondo_ojo = fields.Text(related='ficha_clinica_id.fondo_ojo', readonly=False)
+    observaciones = fields.Text(related='ficha_clinica_id.observaciones', readonly=False)
 
     # Relaciones con consultas
     consulta_ids = fields.One2many(
@@ -116,51 +124,546 @@ class ResPartner(models.Model):
         string='Consultas'
     )
 
-    # Contadores
+    consulta_archivo_ids = fields.One2many(
+        'optica.consulta.archivo',
+        'partner_id',
+        string='Consultas Archivadas'
+    )
+
+    # Contadores (mantenidos por optica.consulta con una consulta agrupada,
+    # ver _actualizar_estadisticas_consultas)
     consulta_count = fields.Integer(
         string='Número de Consultas',
-        compute='_compute_consulta_count',
-        store=True
+        readonly=True,
+        copy=False
+    )
+    consulta_archivo_count = fields.Integer(
+        string='Consultas Archivadas',
+        readonly=True,
+        copy=False
     )
 
     # Última consulta
     ultima_consulta_id = fields.Many2one(
         'optica.consulta',
         string='Última Consulta',
-        compute='_compute_ultima_consulta',
-        store=True
+        readonly=True,
+        copy=False
     )
     ultima_consulta_fecha = fields.Date(
         related='ultima_consulta_id.fecha',
         string='Fecha Última Consulta'
     )
 
+    # Fecha del último recordatorio de control (ver _cron_recordatorios)
+    ultimo_recordatorio = fields.Date(
+        string='Último Recordatorio',
+        readonly=True,
+        copy=False
+    )
+
+    # Claves de bloqueo para la detección de duplicados (ver optica.paciente.duplicado)
+    dup_telefono = fields.Char(
+        string='Teléfono Normalizado',
+        compute='_compute_claves_duplicado',
+        store=True
+    )
+    dup_nombre = fields.Char(
+        string='Clave Fonética',
+        compute='_compute_claves_duplicado',
+        store=True
+    )
+    dup_anio_nacimiento = fields.Integer(
+        string='Año de Nacimiento Estimado',
+        compute='_compute_claves_duplicado',
+        store=True
+    )
+
+    @api.depends('is_optica_patient', 'name', 'phone', 'edad', 'fecha')
+    def _compute_claves_duplicado(self):
+        for partner in self:
+            if not partner.is_optica_patient:
+                partner.dup_telefono = partner.dup_nombre = False
+                partner.dup_anio_nacimiento = False
+                continue
+            partner.dup_telefono = telefono_normalizado(partner.phone)
+            partner.dup_nombre = clave_fonetica(partner.name)
+            partner.dup_anio_nacimiento = (
+                partner.fecha.year - partner.edad if partner.fecha and partner.edad else False
+            )
+
+    # Listado de pacientes (orden por defecto de res.partner), lista negra,
+    # recordatorios, bloques de duplicados, sincronización de tabletas y
+    # búsqueda rápida por trigramas, todos limitados a pacientes de óptica
+    _optica_indices = [
+        ('optica_paciente_idx', '(complete_name, id DESC) WHERE is_optica_patient'),
+        ('optica_lista_negra_idx', '(id) WHERE is_optica_patient AND blacklisted'),
+        ('optica_recordatorio_idx', '(id) INCLUDE (ultima_consulta_id, ultimo_recordatorio) '
+                                    'WHERE is_optica_patient AND NOT blacklisted AND ultima_consulta_id IS NOT NULL'),
+        ('optica_dup_telefono_idx', '(dup_telefono, id) WHERE is_optica_patient AND dup_telefono IS NOT NULL'),
+        ('optica_dup_nombre_idx', '(dup_nombre, id) WHERE is_optica_patient AND dup_nombre IS NOT NULL'),
+        ('optica_sync_idx', '(write_date, id) WHERE is_optica_patient'),
+    ] + [
+        (f'optica_{columna}_trgm_idx', f'USING gin ({columna} gin_trgm_ops) WHERE is_optica_patient')
+        for columna in COLUMNAS_BUSQUEDA_PACIENTE
+    ]
+
+    def init(self):
+        cr = self.env.cr
+        indices = self._optica_indices
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except psycopg2.Error as e:
+            _logger.warning("No se pudo activar pg_trgm, búsqueda de pacientes sin índices trigram: %s", e)
+            indices = [indice for indice in indices if 'gin_trgm_ops' not in indice[1]]
+        crear_indices(cr, self._table, indices)
+
+    @api.model
+    def name_search(self, name='', domain=None, operator='ilike', limit=100):
+        if (name and operator == 'ilike' and PATRON_BUSQUEDA_PACIENTE.match(name)
+                and self._es_dominio_pacientes(domain)):
+            pacientes = self._buscar_pacientes(name, domain, limit)
+            if pacientes:
+                return [(paciente.id, paciente.display_name) for paciente in pacientes]
+        return super().name_search(name, domain, operator, limit)
+
+    @api.model
+    def _es_dominio_pacientes(self, domain):
+        """El dominio restringe a pacientes de óptica (p. ej. consulta.partner_id)"""
+        return self.env.context.get('optica_busqueda_pacientes') or any(
+            isinstance(leaf, (list, tuple)) and tuple(leaf) == ('is_optica_patient', '=', True)
+            for leaf in domain or []
+        )
+
+    @api.model
+    def _buscar_pacientes(self, texto, domain=None, limit=100):
+        """Búsqueda rápida de pacientes por nombre, teléfono o número de ficha
+
+        El ILIKE se aplica directamente sobre las columnas, junto con
+        ``is_optica_patient``, para que PostgreSQL use los índices trigram
+        parciales. El dominio y las reglas de acceso se aplican igualmente.
+        ``%``, ``_`` y ``\\`` del texto se buscan literalmente.
+        """
+        domain = list(domain or []) + [('is_optica_patient', '=', True)]
+        query = self._search(domain, limit=limit)
+        patron = f'%{escape_psql(texto)}%'
+        query.add_where(SQL('(%s)', SQL(' OR ').join(
+            SQL('%s ILIKE %s', SQL.identifier(self._table, columna), patron)
+            for columna in COLUMNAS_BUSQUEDA_PACIENTE
+        )))
+        self.env.cr.execute(query.select())
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
     @api.model_create_multi
     def create(self, vals_list):
-        for vals in vals_list:
-            if vals.get('is_optica_patient') and not vals.get('ficha_numero'):
-                vals['ficha_numero'] = self.env['ir.sequence'].next_by_code('optica.paciente.ficha') or 'Nuevo'
-        return super().create(vals_list)
+        sin_ficha = [
+            vals for vals in vals_list
+            if vals.get('is_optica_patient') and not vals.get('ficha_numero')
+        ]
+        for vals, ficha in zip(sin_ficha, self._reservar_fichas(len(sin_ficha))):
+            vals['ficha_numero'] = ficha
+        # Los valores del cuestionario se guardan después, en la ficha clínica
+        cuestionarios = [
+            {} if vals.get('ficha_clinica_id') else
+            {campo: vals.pop(campo) for campo in CAMPOS_FICHA if campo in vals}
+            for vals in vals_list
+        ]
+        partners = super().create(vals_list)
+        partners._crear_fichas_clinicas(cuestionarios)
+        return partners
 
     def write(self, vals):
-        if vals.get('is_optica_patient'):
-            for record in self:
-                if not record.ficha_numero:
-                    vals['ficha_numero'] = self.env['ir.sequence'].next_by_code('optica.paciente.ficha') or 'Nuevo'
-        return super().write(vals)
-
-    @api.depends('consulta_ids')
-    def _compute_consulta_count(self):
-        for record in self:
-            record.consulta_count = len(record.consulta_ids)
-
-    @api.depends('consulta_ids', 'consulta_ids.fecha')
-    def _compute_ultima_consulta(self):
-        for record in self:
-            if record.consulta_ids:
-                record.ultima_consulta_id = record.consulta_ids.sorted('fecha', reverse=True)[0]
-            else:
-                record.ultima_consulta_id = False
+        # El cuestionario se escribe en lote sobre las fichas clínicas
+        cuestionario = {campo: vals[campo] for campo in CAMPOS_FICHA if campo in vals}
+        if cuestionario:
+            vals = {campo: valor for campo, valor in vals.items() if campo not in cuestionario}
+        if 'is_optica_patient' in vals and not vals['is_optica_patient']:
+            registrar_bajas(self.env, self._table, self.filtered('is_optica_patient').ids)
+        sin_ficha = self.browse()
+        if vals.get('is_optica_patient') and 'ficha_numero' not in vals:
+            sin_ficha = self.filtered(lambda p: not p.ficha_numero)
+        res = super().write(vals)
+        if sin_ficha:
+            sin_ficha._asignar_fichas()
+        if cuestionario:
+            self.ficha_clinica_id.write(cuestionario)
+        if cuestionario or vals.get('is_optica_patient'):
+            self._crear_fichas_clinicas([cuestionario] * len(self))
+        return res
+
+    def unlink(self):
+        # Las consultas se borran en cascada desde la base, sin pasar por su unlink()
+        self.env.cr.execute("SELECT id FROM optica_consulta WHERE partner_id = ANY(%s)", [self.ids])
+        registrar_bajas(self.env, 'optica_consulta', [row[0] for row in self.env.cr.fetchall()])
+        registrar_bajas(self.env, self._table, self.filtered('is_optica_patient').ids)
+        return super().unlink()
+
+    def copy_data(self, default=None):
+        # La ficha no se comparte entre contactos: la copia recibe una ficha
+        # nueva (la crea create()) con el mismo cuestionario
+        vals_list = super().copy_data(default=default)
+        for partner, vals in zip(self, vals_list):
+            ficha = partner.ficha_clinica_id
+            if ficha and not vals.get('ficha_clinica_id'):
+                vals.update({campo: ficha[campo] for campo in CAMPOS_FICHA if campo not in vals})
+        return vals_list
+
+    def _crear_fichas_clinicas(self, cuestionarios=None):
+        """Crear en lote la ficha clínica de los contactos que la necesitan
+
+        La necesitan los pacientes y los contactos con algún dato del
+        cuestionario; los demás contactos no tienen ficha.
+
+        :param cuestionarios: valores del cuestionario de cada contacto, en
+            el mismo orden que ``self``
+        """
+        cuestionarios = cuestionarios or [{}] * len(self)
+        pendientes = [
+            (partner, cuestionario)
+            for partner, cuestionario in zip(self, cuestionarios)
+            if not partner.ficha_clinica_id
+            and (partner.is_optica_patient or any(cuestionario.values()))
+        ]
+        if not pendientes:
+            return
+        fichas = self.env['optica.ficha.clinica'].sudo().create([
+            dict(cuestionario, partner_id=partner.id) for partner, cuestionario in pendientes
+        ])
+        self.env.cr.execute(
+            """
+            UPDATE res_partner AS partner
+               SET ficha_clinica_id = enlace.ficha_id
+              FROM unnest(%s::int[], %s::int[]) AS enlace(id, ficha_id)
+             WHERE partner.id = enlace.id
+            """,
+            [[partner.id for partner, _cuestionario in pendientes], fichas.ids]
+        )
+        self.invalidate_recordset(['ficha_clinica_id'])
+
+    @api.model
+    def _reservar_fichas(self, cantidad):
+        """Reservar ``cantidad`` números de ficha consecutivos de una sola vez
+
+        Para secuencias estándar se piden todos los valores con un único
+        ``nextval`` sobre ``generate_series``; para secuencias sin huecos se
+        avanza ``number_next`` con un solo UPDATE.
+        """
+        if cantidad <= 0:
+            return []
+        secuencia = self.env['ir.sequence'].sudo().search([
+            ('code', '=', 'optica.paciente.ficha'),
+            ('company_id', 'in', [self.env.company.id, False]),
+        ], order='company_id', limit=1)
+        if not secuencia:
+            return ['Nuevo'] * cantidad
+        if secuencia.use_date_range:
+            return [secuencia._next() for _i in range(cantidad)]
+        if secuencia.implementation == 'standard':
+            self.env.cr.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                ['ir_sequence_%03d' % secuencia.id, cantidad]
+            )
+            numeros = [row[0] for row in self.env.cr.fetchall()]
+        else:
+            incremento = secuencia.number_increment
+            self.env.cr.execute(
+                """
+                UPDATE ir_sequence
+                   SET number_next = number_next + %s
+                 WHERE id = %s
+             RETURNING number_next
+                """,
+                [cantidad * incremento, secuencia.id]
+            )
+            inicio = self.env.cr.fetchone()[0] - cantidad * incremento
+            numeros = [inicio + i * incremento for i in range(cantidad)]
+            secuencia.invalidate_recordset(['number_next'])
+        return [secuencia.get_next_char(numero) for numero in numeros]
+
+    def _asignar_fichas(self):
+        """Asignar a cada paciente su número de ficha con un solo UPDATE"""
+        fichas = self._reservar_fichas(len(self))
+        self.env.cr.execute(
+            """
+            UPDATE res_partner AS partner
+               SET ficha_numero = asignacion.ficha
+              FROM unnest(%s::int[], %s::varchar[]) AS asignacion(id, ficha)
+             WHERE partner.id = asignacion.id
+            """,
+            [self.ids, fichas]
+        )
+        self.invalidate_recordset(['ficha_numero'])
+
+    def _actualizar_estadisticas_consultas(self):
+        """Recalcular contadores y última consulta de todo el lote en una sola sentencia
+
+        La última consulta siempre es una consulta activa: el archivo nunca
+        mueve la consulta más reciente de un paciente.
+        """
+        partner_ids = [pid for pid in self.ids if isinstance(pid, int)]
+        if not partner_ids:
+            return
+        self.env['optica.consulta'].flush_model(['partner_id', 'fecha'])
+        self.env['optica.consulta.archivo'].flush_model(['partner_id'])
+        self.env.cr.execute(
+            """
+            UPDATE res_partner AS partner
+               SET consulta_count = COALESCE(stats.total, 0),
+                   consulta_archivo_count = COALESCE(archivo.total, 0),
+                   ultima_consulta_id = stats.ultima_id
+              FROM unnest(%s::int[]) AS afectado(id)
+              LEFT JOIN (
+                    SELECT partner_id,
+                           count(*) AS total,
+                           (array_agg(id ORDER BY fecha DESC, id DESC))[1] AS ultima_id
+                      FROM optica_consulta
+                     WHERE partner_id = ANY(%s)
+                  GROUP BY partner_id
+              ) AS stats ON stats.partner_id = afectado.id
+              LEFT JOIN (
+                    SELECT partner_id, count(*) AS total
+                      FROM optica_consulta_archivo
+                     WHERE partner_id = ANY(%s)
+                  GROUP BY partner_id
+              ) AS archivo ON archivo.partner_id = afectado.id
+             WHERE partner.id = afectado.id
+            """,
+            [partner_ids, partner_ids, partner_ids]
+        )
+        self.invalidate_recordset(['consulta_count', 'consulta_archivo_count', 'ultima_consulta_id'])
+
+    def _programar_estadisticas_consultas(self):
+        """Recalcular las estadísticas de consultas ahora o al final de la transacción
+
+        Con ``optica_diferir_estadisticas`` en el contexto (cargas masivas) los
+        pacientes afectados se acumulan sin repetir y se recalculan una sola
+        vez justo antes del commit.
+        """
+        if not self.env.context.get('optica_diferir_estadisticas'):
+            self._actualizar_estadisticas_consultas()
+            return
+        precommit = self.env.cr.precommit
+        pendientes = precommit.data.setdefault('optica.partner.estadisticas', set())
+        # La marca registra el hook una sola vez por transacción, aunque el
+        # conjunto se vacíe (por ejemplo, al llamar antes solo con ids nuevos)
+        if not precommit.data.get('optica.partner.estadisticas.hook'):
+            precommit.data['optica.partner.estadisticas.hook'] = True
+            partners = self.env['res.partner']
+
+            @precommit.add
+            def _actualizar_pendientes():
+                partners.browse(pendientes)._actualizar_estadisticas_consultas()
+
+        pendientes.update(pid for pid in self.ids if isinstance(pid, int))
+
+    # ==================== HISTORIAL DE REFRACCIÓN ====================
+    def get_historial_refraccion(self):
+        """Línea de tiempo de refracción del paciente, de la consulta más antigua a la más reciente
+
+        Incluye las consultas archivadas. Cada visita trae en ``valores`` las
+        graduaciones numéricas de RX, lensometría y retinoscopía más PIO y
+        DIP, y en ``deltas`` la diferencia de cada valor con el último
+        registrado en una visita anterior. El resultado se memoriza por
+        paciente y firma (número de consultas, último write_date y avance del
+        relleno de graduaciones), así cualquier cambio en sus consultas lo
+        renueva.
+        """
+        self.ensure_one()
+        self.check_access('read')
+        Consulta = self.env['optica.consulta']
+        Consulta.check_access('read')
+        Consulta.flush_model()
+        self.env['optica.consulta.archivo'].flush_model()
+        self.env.cr.execute(
+            """
+            SELECT count(*), max(write_date),
+                   (SELECT value FROM ir_config_parameter WHERE key = %s)
+              FROM (SELECT write_date FROM optica_consulta WHERE partner_id = %s
+                    UNION ALL
+                    SELECT write_date FROM optica_consulta_archivo WHERE partner_id = %s) AS consultas
+            """,
+            [PARAM_BACKFILL_REFRACCION, self.id, self.id]
+        )
+        firma = self.env.cr.fetchone()
+        return [
+            dict(visita, valores=dict(visita['valores']), deltas=dict(visita['deltas']))
+            for visita in self._leer_historial_refraccion(self.id, firma)
+        ]
+
+    @ormcache('partner_id', 'firma')
+    def _leer_historial_refraccion(self, partner_id, firma):
+        campos = self.env['optica.consulta'].CAMPOS_HISTORIAL
+        # PIO y DIP se guardan como 0 cuando no se midieron
+        columnas = ', '.join(
+            f'"{campo}"' if campo.endswith('_num') else f'NULLIF("{campo}", 0)::float8'
+            for campo in campos
+        )
+        self.env.cr.execute(
+            f"""
+            SELECT id, fecha, {columnas} FROM optica_consulta WHERE partner_id = %s
+             UNION ALL
+            SELECT id, fecha, {columnas} FROM optica_consulta_archivo WHERE partner_id = %s
+          ORDER BY fecha, id
+            """,
+            [partner_id, partner_id]
+        )
+        historial = []
+        anteriores = {}
+        for consulta_id, fecha, *fila in self.env.cr.fetchall():
+            valores = dict(zip(campos, fila))
+            deltas = {}
+            for campo, valor in valores.items():
+                if valor is None:
+                    continue
+                if campo in anteriores:
+                    deltas[campo] = round(valor - anteriores[campo], 2)
+                anteriores[campo] = valor
+            historial.append({
+                'consulta_id': consulta_id,
+                'fecha': fields.Date.to_string(fecha),
+                'valores': valores,
+                'deltas': deltas,
+            })
+        return tuple(historial)
+
+    # ==================== RECORDATORIOS DE CONTROL ====================
+    @api.model
+    def _cron_recordatorios(self, modo='actividad', meses_control=12, dias_anticipacion=7,
+                            tamano_lote=1000, max_lotes=200):
+        """Crear recordatorios para los pacientes que deben volver a control
+
+        Un paciente vence en la ``proxima_cita_sugerida`` de su última
+        consulta o, si no tiene, ``meses_control`` después de ella. Se omiten
+        la lista negra, quienes ya tienen una cita pendiente y quienes ya
+        recibieron recordatorio desde su última consulta.
+
+        :param modo: ``'actividad'`` crea una actividad de recordatorio en el
+            paciente, ``'cita'`` una cita en borrador sin optometrista
+        :param dias_anticipacion: recordar con estos días de antelación
+
+        Los pacientes se recorren por id en lotes confirmados por separado; la
+        marca de avance del día permite reanudar una corrida interrumpida.
+        """
+        hoy = fields.Date.context_today(self)
+        if leer_parametro(self.env.cr, PARAM_RECORDATORIO_FECHA) != fields.Date.to_string(hoy):
+            guardar_parametro(self.env, PARAM_RECORDATORIO_FECHA, fields.Date.to_string(hoy))
+            guardar_parametro(self.env, PARAM_RECORDATORIO_ID, 0)
+        ultimo_id = int(leer_parametro(self.env.cr, PARAM_RECORDATORIO_ID, 0))
+        total = 0
+        for _lote in range(max_lotes):
+            pendientes = self._buscar_recordatorios_pendientes(
+                ultimo_id, hoy, meses_control, dias_anticipacion, tamano_lote
+            )
+            if not pendientes:
+                break
+            self._crear_recordatorios(pendientes, modo, hoy)
+            total += len(pendientes)
+            ultimo_id = pendientes[-1][0]
+            guardar_parametro(self.env, PARAM_RECORDATORIO_ID, ultimo_id)
+            self.env.cr.commit()
+            self.env.invalidate_all()
+        if total:
+            _logger.info("Recordatorios de control: %s pacientes (%s)", total, modo)
+        return True
+
+    @api.model
+    def _buscar_recordatorios_pendientes(self, ultimo_id, hoy, meses_control, dias_anticipacion, limite):
+        """Siguiente lote de ``(partner_id, vencimiento)`` con id mayor a ``ultimo_id``"""
+        self.env.cr.execute(
+            """
+            SELECT p.id, COALESCE(c.proxima_cita_sugerida, (c.fecha + %(meses)s * interval '1 month')::date)
+              FROM res_partner p
+              JOIN optica_consulta c ON c.id = p.ultima_consulta_id
+             WHERE p.is_optica_patient
+               AND NOT p.blacklisted
+               AND p.ultima_consulta_id IS NOT NULL
+               AND p.active
+               AND p.id > %(ultimo_id)s
+               AND (p.ultimo_recordatorio IS NULL OR p.ultimo_recordatorio < c.fecha)
+               AND COALESCE(c.proxima_cita_sugerida, (c.fecha + %(meses)s * interval '1 month')::date) <= %(limite_fecha)s
+               AND NOT EXISTS (
+                    SELECT 1 FROM optica_cita cita
+                     WHERE cita.partner_id = p.id
+                       AND cita.fecha >= %(hoy)s
+                       AND cita.state IN ('borrador', 'confirmada')
+               )
+          ORDER BY p.id
+             LIMIT %(limite)s
+            """,
+            {
+                'meses': meses_control,
+                'ultimo_id': ultimo_id,
+                'hoy': hoy,
+                'limite_fecha': hoy + relativedelta(days=dias_anticipacion),
+                'limite': limite,
+            }
+        )
+        return self.env.cr.fetchall()
+
+    @api.model
+    def _crear_recordatorios(self, pendientes, modo, hoy):
+        """Crear en bloque las citas o actividades de un lote y marcar a los pacientes"""
+        partners = self.browse([partner_id for partner_id, _vence in pendientes])
+        vencimientos = dict(pendientes)
+        if modo == 'cita':
+            manana = hoy + relativedelta(days=1)
+            self.env['optica.cita'].with_context(tracking_disable=True).create([{
+                'partner_id': partner.id,
+                'nombre': partner.name,
+                'telefono': partner.phone,
+                'correo': partner.email,
+                'fecha': max(vencimientos[partner.id], manana),
+                'optometrista_id': False,
+                'notas': 'Recordatorio de control',
+            } for partner in partners])
+        else:
+            tipo = self.env.ref('optica_gestion.mail_activity_type_recordatorio')
+            por_defecto = self.env.ref('base.user_admin', raise_if_not_found=False)
+            self.env['mail.activity'].with_context(mail_activity_quick_update=True).create([{
+                'res_model_id': self.env['ir.model']._get_id('res.partner'),
+                'res_id': partner.id,
+                'activity_type_id': tipo.id,
+                'summary': tipo.summary or tipo.name,
+                'date_deadline': max(vencimientos[partner.id], hoy),
+                'user_id': partner._usuario_recordatorio(tipo, por_defecto).id,
+            } for partner in partners])
+        self.env.cr.execute(
+            "UPDATE res_partner SET ultimo_recordatorio = %s WHERE id = ANY(%s)",
+            [hoy, partners.ids]
+        )
+        partners.invalidate_recordset(['ultimo_recordatorio'])
+
+    def _usuario_recordatorio(self, tipo, por_defecto):
+        """Usuario al que se asigna la actividad de recordatorio del paciente
+
+        El cron corre como OdooBot, así que nunca se usa el usuario actual: se
+        prefiere el usuario por defecto del tipo de actividad, luego el
+        optometrista de la última consulta, luego el comercial del paciente y
+        por último el administrador.
+        """
+        self.ensure_one()
+        candidatos = (
+            tipo.default_user_id,
+            self.ultima_consulta_id.optometrista_id,
+            self.user_id,
+            por_defecto,
+        )
+        for usuario in candidatos:
+            if usuario and usuario.active and usuario._is_internal() and not usuario._is_superuser():
+                return usuario
+        return por_defecto
+
+    def action_ver_progresion(self):
+        self.ensure_one()
+        visitas = self.env['optica.progresion.refraccion']._crear_desde_historial(self)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Progresión de %s' % self.name,
+            'res_model': 'optica.progresion.refraccion',
+            'view_mode': 'graph,list',
+            'domain': [('id', 'in', visitas.ids)],
+        }
 
     def action_ver_consultas(self):
         self.ensure_one()
@@ -173,6 +676,16 @@ class ResPartner(models.Model):
             'context': {'default_partner_id': self.id}
         }
 
+    def action_ver_consultas_archivadas(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Consultas archivadas de %s' % self.name,
+            'res_model': 'optica.consulta.archivo',
+            'view_mode': 'list,form',
+            'domain': [('partner_id', '=', self.id)],
+        }
+
     def action_nueva_consulta(self):
         self.ensure_one()
         return {
@@ -0,0 +1,71 @@
+from odoo import models, fields, api
+
+# Valores de la línea de tiempo que se grafican: campo de la progresión y
+# clave en ``valores``/``deltas`` de res.partner.get_historial_refraccion()
+CAMPOS_PROGRESION = {
+    'rx_od_esfera': 'rx_od_esfera_num',
+    'rx_oi_esfera': 'rx_oi_esfera_num',
+    'rx_od_cilindro': 'rx_od_cilindro_num',
+    'rx_oi_cilindro': 'rx_oi_cilindro_num',
+    'rx_od_add': 'rx_od_add_num',
+    'rx_oi_add': 'rx_oi_add_num',
+    'lens_od_esfera': 'lens_od_esfera_num',
+    'lens_oi_esfera': 'lens_oi_esfera_num',
+    'presion_od': 'presion_od',
+    'presion_oi': 'presion_oi',
+}
+
+
+class OpticaProgresionRefraccion(models.TransientModel):
+    """Una fila por visita de la línea de tiempo de refracción de un paciente
+
+    Se llena desde el historial memorizado del paciente cada vez que se abre
+    la progresión, así el gráfico muestra cada visita (activa o archivada)
+    con su cambio respecto de la anterior, sin agrupar por mes.
+    """
+    _name = 'optica.progresion.refraccion'
+    _description = 'Progresión de Refracción por Visita'
+    _order = 'fecha, consulta_id'
+
+    partner_id = fields.Many2one('res.partner', string='Paciente', readonly=True, ondelete='cascade')
+    consulta_id = fields.Integer(string='Consulta', readonly=True)
+    fecha = fields.Date(string='Fecha', readonly=True)
+
+    rx_od_esfera = fields.Float(string='RX OD Esfera', readonly=True, aggregator='avg')
+    rx_oi_esfera = fields.Float(string='RX OI Esfera', readonly=True, aggregator='avg')
+    rx_od_cilindro = fields.Float(string='RX OD Cilindro', readonly=True, aggregator='avg')
+    rx_oi_cilindro = fields.Float(string='RX OI Cilindro', readonly=True, aggregator='avg')
+    rx_od_add = fields.Float(string='RX OD ADD', readonly=True, aggregator='avg')
+    rx_oi_add = fields.Float(string='RX OI ADD', readonly=True, aggregator='avg')
+    lens_od_esfera = fields.Float(string='Lens OD Esfera', readonly=True, aggregator='avg')
+    lens_oi_esfera = fields.Float(string='Lens OI Esfera', readonly=True, aggregator='avg')
+    presion_od = fields.Float(string='Presión OD', readonly=True, aggregator='avg')
+    presion_oi = fields.Float(string='Presión OI', readonly=True, aggregator='avg')
+
+    # Cambio de cada valor respecto de la última visita en que se registró
+    rx_od_esfera_delta = fields.Float(string='Δ RX OD Esfera', readonly=True, aggregator='avg')
+    rx_oi_esfera_delta = fields.Float(string='Δ RX OI Esfera', readonly=True, aggregator='avg')
+    rx_od_cilindro_delta = fields.Float(string='Δ RX OD Cilindro', readonly=True, aggregator='avg')
+    rx_oi_cilindro_delta = fields.Float(string='Δ RX OI Cilindro', readonly=True, aggregator='avg')
+    rx_od_add_delta = fields.Float(string='Δ RX OD ADD', readonly=True, aggregator='avg')
+    rx_oi_add_delta = fields.Float(string='Δ RX OI ADD', readonly=True, aggregator='avg')
+    lens_od_esfera_delta = fields.Float(string='Δ Lens OD Esfera', readonly=True, aggregator='avg')
+    lens_oi_esfera_delta = fields.Float(string='Δ Lens OI Esfera', readonly=True, aggregator='avg')
+    presion_od_delta = fields.Float(string='Δ Presión OD', readonly=True, aggregator='avg')
+    presion_oi_delta = fields.Float(string='Δ Presión OI', readonly=True, aggregator='avg')
+
+    @api.model
+    def _crear_desde_historial(self, partner):
+        """Filas de la progresión de ``partner`` a partir de su historial memorizado"""
+        valores_list = []
+        for visita in partner.get_historial_refraccion():
+            valores = {
+                'partner_id': partner.id,
+                'consulta_id': visita['consulta_id'],
+                'fecha': visita['fecha'],
+            }
+            for campo, clave in CAMPOS_PROGRESION.items():
+                valores[campo] = visita['valores'].get(clave)
+                valores[f'{campo}_delta'] = visita['deltas'].get(clave)
+            valores_list.append(valores)
+        return self.create(valores_list)
@@ -0,0 +1,245 @@
+from odoo import models, fields, api
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from .parametros import leer_parametro, guardar_parametro
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Fechas a recalcular que write_date no delata (fechas anteriores de registros
+# modificados y fechas de registros eliminados), por tabla de origen
+TABLA_PENDIENTES = 'optica_reporte_pendiente'
+
+# Margen hacia atrás de cada marca de agua para cubrir transacciones que
+# escribieron antes de la última actualización pero confirmaron después
+MARGEN_MARCA = timedelta(minutes=10)
+
+
+def marcar_pendientes(records):
+    """Anotar las fechas actuales de ``records`` para el próximo refresco de los cubos"""
+    ids = [rid for rid in records.ids if isinstance(rid, int)]
+    if not ids:
+        return
+    records.flush_recordset(['fecha'])
+    records.env.cr.execute(
+        f"""
+        INSERT INTO {TABLA_PENDIENTES} (tabla, fecha)
+        SELECT %s, fecha FROM "{records._table}" WHERE id = ANY(%s) AND fecha IS NOT NULL
+        """,
+        [records._table, ids]
+    )
+
+
+class OpticaReporteBase(models.AbstractModel):
+    """Cubo de reporte guardado en una tabla resumen
+
+    Cada cubo agrupa una tabla de origen por fecha (``_columna_periodo``) y
+    se refresca recalculando solo los periodos tocados desde la última
+    marca de agua de write_date, más los anotados en TABLA_PENDIENTES.
+    Pivotes y gráficos leen únicamente la tabla resumen.
+    """
+    _name = 'optica.reporte.base'
+    _description = 'Cubo de Reporte de Óptica'
+
+    # Tabla de origen, columna de periodo del cubo y expresión SQL que la
+    # calcula a partir de la columna fecha del origen; _columnas son las
+    # columnas de la tabla resumen en el orden de _consulta_agregada()
+    _tabla_origen = None
+    _tablas_pendientes = ()
+    _columna_periodo = 'fecha'
+    _expresion_periodo = 'fecha'
+    _paso_periodo = relativedelta(days=1)
+    _columnas = ()
+
+    def _definicion_tabla(self):
+        """Definición SQL de las columnas (sin id) de la tabla resumen"""
+        raise NotImplementedError(f"El cubo {self._name} debe definir _definicion_tabla()")
+
+    def _consulta_agregada(self, filtrar):
+        """SELECT agregado sobre el origen; con ``filtrar`` solo para los
+        periodos ``%(periodos)s`` comprendidos entre ``%(desde)s`` y ``%(hasta)s``"""
+        raise NotImplementedError(f"El cubo {self._name} debe definir _consulta_agregada()")
+
+    def init(self):
+        cr = self.env.cr
+        cr.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {TABLA_PENDIENTES} (
+                tabla varchar NOT NULL,
+                fecha date NOT NULL
+            )
+            """
+        )
+        cr.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLA_PENDIENTES}_tabla_idx ON {TABLA_PENDIENTES} (tabla)"
+        )
+        if self._abstract:
+            return
+        cr.execute(
+            f'CREATE TABLE IF NOT EXISTS "{self._table}" (id serial PRIMARY KEY, {self._definicion_tabla()})'
+        )
+        cr.execute(
+            f'CREATE INDEX IF NOT EXISTS "{self._table}_periodo_idx" ON "{self._table}" ("{self._columna_periodo}")'
+        )
+
+    @api.model
+    def _cron_refrescar_reportes(self):
+        for modelo in ('optica.reporte.citas', 'optica.reporte.lentes'):
+            self.env[modelo]._refrescar()
+            self.env.cr.commit()
+        return True
+
+    @api.model
+    def _refrescar(self, completo=False):
+        """Recalcular los periodos modificados desde la última marca de agua
+
+        Sin marca previa (o con ``completo=True``) se reconstruye todo el cubo.
+        """
+        cr = self.env.cr
+        self.env.flush_all()
+        param_marca = f'optica_gestion.{self._table}_marca'
+        marca = leer_parametro(cr, param_marca)
+        nueva_marca = cr.now() - MARGEN_MARCA
+        columnas = ', '.join(f'"{columna}"' for columna in self._columnas)
+        tablas_pendientes = list(self._tablas_pendientes or [self._tabla_origen])
+
+        if completo or not marca:
+            cr.execute(f'TRUNCATE "{self._table}"')
+            cr.execute(
+                f'INSERT INTO "{self._table}" ({columnas}) {self._consulta_agregada(filtrar=False)}'
+            )
+            cr.execute(f"DELETE FROM {TABLA_PENDIENTES} WHERE tabla = ANY(%s)", [tablas_pendientes])
+        else:
+            cr.execute(
+                f"""
+                SELECT DISTINCT {self._expresion_periodo} FROM "{self._tabla_origen}" WHERE write_date > %s
+                 UNION
+                SELECT DISTINCT {self._expresion_periodo} FROM {TABLA_PENDIENTES} WHERE tabla = ANY(%s)
+                """,
+                [marca, tablas_pendientes]
+            )
+            periodos = [row[0] for row in cr.fetchall() if row[0]]
+            if periodos:
+                cr.execute(
+                    f'DELETE FROM "{self._table}" WHERE "{self._columna_periodo}" = ANY(%s)', [periodos]
+                )
+                cr.execute(
+                    f'INSERT INTO "{self._table}" ({columnas}) {self._consulta_agregada(filtrar=True)}',
+                    {
+                        'periodos': periodos,
+                        'desde': min(periodos),
+                        'hasta': max(periodos) + self._paso_periodo,
+                    }
+                )
+                cr.execute(
+                    f"DELETE FROM {TABLA_PENDIENTES} WHERE tabla = ANY(%s) AND {self._expresion_periodo} = ANY(%s)",
+                    [tablas_pendientes, periodos]
+                )
+            _logger.info("Reporte %s: %s periodos recalculados", self._name, len(periodos))
+        guardar_parametro(self.env, param_marca, fields.Datetime.to_string(nueva_marca))
+        self.env.invalidate_all()
+        return True
+
+
+class OpticaReporteCitas(models.Model):
+    _name = 'optica.reporte.citas'
+    _inherit = 'optica.reporte.base'
+    _description = 'Reporte de Citas'
+    _auto = False
+    _order = 'fecha desc'
+    _rec_name = 'fecha'
+
+    _tabla_origen = 'optica_cita'
+    _columnas = ('fecha', 'optometrista_id', 'state', 'cantidad', 'no_asistio', 'personas_atendidas')
+
+    fecha = fields.Date(string='Fecha', readonly=True)
+    optometrista_id = fields.Many2one('res.users', string='Optometrista', readonly=True)
+    state = fields.Selection(
+        selection=lambda self: self.env['optica.cita']._fields['state'].selection,
+        string='Estado',
+        readonly=True
+    )
+    cantidad = fields.Integer(string='Citas', readonly=True)
+    no_asistio = fields.Integer(string='No Asistieron', readonly=True)
+    personas_atendidas = fields.Integer(string='Personas Atendidas', readonly=True)
+
+    def _definicion_tabla(self):
+        return """
+            fecha date NOT NULL,
+            optometrista_id integer,
+            state varchar,
+            cantidad integer NOT NULL DEFAULT 0,
+            no_asistio integer NOT NULL DEFAULT 0,
+            personas_atendidas integer NOT NULL DEFAULT 0
+        """
+
+    def _consulta_agregada(self, filtrar):
+        return f"""
+            SELECT fecha, optometrista_id, state,
+                   count(*),
+                   count(*) FILTER (WHERE state = 'no_asistio'),
+                   COALESCE(sum(cantidad_personas) FILTER (WHERE state = 'completada'), 0)
+              FROM optica_cita
+             {'WHERE fecha = ANY(%(periodos)s)' if filtrar else ''}
+          GROUP BY fecha, optometrista_id, state
+        """
+
+
+class OpticaReporteLentes(models.Model):
+    _name = 'optica.reporte.lentes'
+    _inherit = 'optica.reporte.base'
+    _description = 'Reporte de Lentes'
+    _auto = False
+    _order = 'mes desc'
+    _rec_name = 'mes'
+
+    # Incluye las consultas archivadas: el archivo mueve filas sin cambiar
+    # los totales del mes, así que solo las activas cuentan por write_date
+    _tabla_origen = 'optica_consulta'
+    _tablas_pendientes = ('optica_consulta', 'optica_consulta_archivo')
+    _columna_periodo = 'mes'
+    _expresion_periodo = "date_trunc('month', fecha)::date"
+    _paso_periodo = relativedelta(months=1)
+    _columnas = ('mes', 'tipo_lente', 'material_lente', 'tratamientos_lente', 'cantidad')
+
+    mes = fields.Date(string='Mes', readonly=True)
+    tipo_lente = fields.Selection(
+        selection=lambda self: self.env['optica.consulta']._fields['tipo_lente'].selection,
+        string='Tipo de Lente',
+        readonly=True
+    )
+    material_lente = fields.Selection(
+        selection=lambda self: self.env['optica.consulta']._fields['material_lente'].selection,
+        string='Material',
+        readonly=True
+    )
+    tratamientos_lente = fields.Selection(
+        selection=lambda self: self.env['optica.consulta']._fields['tratamientos_lente'].selection,
+        string='Tratamiento',
+        readonly=True
+    )
+    cantidad = fields.Integer(string='Consultas', readonly=True)
+
+    def _definicion_tabla(self):
+        return """
+            mes date NOT NULL,
+            tipo_lente varchar,
+            material_lente varchar,
+            tratamientos_lente varchar,
+            cantidad integer NOT NULL DEFAULT 0
+        """
+
+    def _consulta_agregada(self, filtrar):
+        filtro = ''
+        if filtrar:
+            filtro = f"""WHERE fecha >= %(desde)s AND fecha < %(hasta)s
+                         AND {self._expresion_periodo} = ANY(%(periodos)s)"""
+        return f"""
+            SELECT {self._expresion_periodo}, tipo_lente, material_lente, tratamientos_lente, count(*)
+              FROM (
+                    SELECT fecha, tipo_lente, material_lente, tratamientos_lente FROM optica_consulta {filtro}
+                     UNION ALL
+                    SELECT fecha, tipo_lente, material_lente, tratamientos_lente FROM optica_consulta_archivo {filtro}
+              ) AS consultas
+          GROUP BY 1, tipo_lente, material_lente, tratamientos_lente
+        """
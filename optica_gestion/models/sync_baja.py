@@ -0,0 +1,49 @@
+from odoo import models, fields, api
+from datetime import timedelta
+
+# Días que se guardan las bajas; una tableta con un cursor más antiguo debe
+# descargar todo de nuevo (el pull se lo indica con ``reiniciar``)
+RETENCION_BAJAS = 60
+
+
+def registrar_bajas(env, tabla, ids):
+    """Anotar que los registros ``ids`` de ``tabla`` dejaron de sincronizarse"""
+    ids = [rid for rid in ids if isinstance(rid, int)]
+    if not ids:
+        return
+    env.cr.execute(
+        """
+        INSERT INTO optica_sync_baja (tabla, registro_id, create_uid, create_date, write_uid, write_date)
+        SELECT %s, registro_id, %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+          FROM unnest(%s::int[]) AS registro_id
+        """,
+        [tabla, env.uid, env.uid, ids]
+    )
+
+
+class OpticaSyncBaja(models.Model):
+    """Registros que las tabletas deben borrar en el próximo pull
+
+    Se anotan las consultas eliminadas o movidas al archivo, las citas
+    eliminadas o cambiadas de día y los pacientes eliminados o que dejaron
+    de ser pacientes. Solo se escriben con SQL desde ``registrar_bajas``.
+    """
+    _name = 'optica.sync.baja'
+    _description = 'Baja para la Sincronización de Tabletas'
+    _order = 'create_date, id'
+
+    tabla = fields.Char(string='Tabla', required=True, readonly=True)
+    registro_id = fields.Integer(string='Registro', required=True, readonly=True)
+
+    def init(self):
+        self.env.cr.execute(
+            f'CREATE INDEX IF NOT EXISTS "{self._table}_tabla_fecha_idx" ON "{self._table}" (tabla, create_date, id)'
+        )
+
+    @api.model
+    def _cron_purgar(self, dias=RETENCION_BAJAS):
+        self.env.cr.execute(
+            f'DELETE FROM "{self._table}" WHERE create_date < %s',
+            [fields.Datetime.now() - timedelta(days=dias)]
+        )
+        return True
@@ -0,0 +1,74 @@
+from odoo import models, fields, Command
+
+# A partir de este número de registros, write() registra el tracking en lote
+UMBRAL_TRACKING_LOTE = 20
+
+
+class OpticaTrackingLote(models.AbstractModel):
+    _name = 'optica.tracking.lote'
+    _description = 'Tracking en lote para operaciones masivas'
+    _inherit = ['mail.thread']
+
+    def write(self, vals):
+        """En escrituras masivas, registrar el tracking con un solo create de mensajes
+
+        El tracking estándar crea y procesa un mensaje por registro; aquí se
+        leen los valores iniciales de todo el lote, se escribe sin tracking y
+        se insertan todos los mensajes con sus valores de tracking de una vez.
+        El historial del chatter queda igual.
+        """
+        if (len(self) < UMBRAL_TRACKING_LOTE
+                or self.env.context.get('tracking_disable')
+                or self.env.context.get('mail_notrack')):
+            return super().write(vals)
+        campos = self._track_get_fields() & set(vals)
+        if not campos:
+            return super().write(vals)
+        valores_iniciales = self._leer_valores_tracking(campos)
+        res = super(OpticaTrackingLote, self.with_context(tracking_disable=True)).write(vals)
+        self._registrar_tracking_lote(valores_iniciales)
+        return res
+
+    def _leer_valores_tracking(self, campos):
+        """Valores actuales de los campos con tracking, por id de registro"""
+        return {
+            record.id: {campo: record[campo] for campo in campos}
+            for record in self
+        }
+
+    def _registrar_tracking_lote(self, valores_iniciales):
+        """Crear en una sola operación los mensajes de tracking del lote
+
+        :param valores_iniciales: ``{id: {campo: valor inicial}}`` obtenido con
+            :meth:`_leer_valores_tracking` antes del cambio
+        """
+        campos = {campo for valores in valores_iniciales.values() for campo in valores}
+        if not campos:
+            return
+        col_info = self.fields_get(list(campos), attributes=('string', 'type', 'selection', 'currency_field'))
+        Tracking = self.env['mail.tracking.value']
+        subtype_id = self.env['ir.model.data']._xmlid_to_res_id('mail.mt_note')
+        author_id = self.env.user.partner_id.id
+        ahora = fields.Datetime.now()
+        mensajes = []
+        for record in self:
+            tracking = []
+            for campo, inicial in valores_iniciales.get(record.id, {}).items():
+                nuevo = record[campo]
+                if nuevo != inicial and (nuevo or inicial):
+                    tracking.append(Command.create(
+                        Tracking._create_tracking_values(inicial, nuevo, campo, col_info[campo], record)
+                    ))
+            if tracking:
+                mensajes.append({
+                    'model': record._name,
+                    'res_id': record.id,
+                    'message_type': 'notification',
+                    'subtype_id': subtype_id,
+                    'author_id': author_id,
+                    'date': ahora,
+                    'body': '',
+                    'tracking_value_ids': tracking,
+                })
+        if mensajes:
+            self.env['mail.message'].sudo().create(mensajes)
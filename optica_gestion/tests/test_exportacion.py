@@ -0,0 +1,76 @@
+import csv
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestExportacion(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.paciente = cls.env['res.partner'].create({
+            'name': 'Paciente Exportación',
+            'is_optica_patient': True,
+            'cefalea': True,
+        })
+        cls.sin_consultas = cls.env['res.partner'].create({
+            'name': 'Paciente Sin Consultas',
+            'is_optica_patient': True,
+        })
+        cls.consulta = cls.env['optica.consulta'].create({
+            'partner_id': cls.paciente.id,
+            'rx_od_esfera': '-1.25',
+        })
+
+    def _exportar(self, formato):
+        exportacion = self.env['optica.exportacion'].create({'name': 'Prueba', 'formato': formato})
+        self.addCleanup(exportacion.unlink)
+        # _procesar lee desde un cursor nuevo del registro: en modo de prueba ese
+        # cursor reutiliza la transacción de la prueba y ve los datos de setUpClass.
+        # El avance se confirma en cada tramo; dentro de la prueba no se confirma nada
+        with self.enter_registry_test_mode(), \
+                patch.object(self.env.cr, 'commit'), patch.object(self.env.cr, 'rollback'):
+            exportacion._procesar()
+        return exportacion
+
+    def _filas_esperadas(self):
+        """Una fila por consulta (activa o archivada) o por paciente sin consultas"""
+        self.env.flush_all()
+        self.env.cr.execute(
+            """
+            SELECT sum(GREATEST(1, (SELECT count(*) FROM optica_consulta c WHERE c.partner_id = p.id)
+                                 + (SELECT count(*) FROM optica_consulta_archivo a WHERE a.partner_id = p.id)))
+              FROM res_partner p
+             WHERE p.is_optica_patient AND p.active
+            """
+        )
+        return self.env.cr.fetchone()[0]
+
+    def test_exportar_csv(self):
+        exportacion = self._exportar('csv')
+        self.assertEqual(exportacion.state, 'hecho', exportacion.log)
+        with open(exportacion._ruta_archivo(), newline='', encoding='utf-8-sig') as archivo:
+            filas = list(csv.DictReader(archivo))
+        self.assertEqual(len(filas), self._filas_esperadas())
+        self.assertEqual(exportacion.filas, len(filas))
+        self.assertEqual(exportacion.total_filas, len(filas))
+
+        del_paciente = [fila for fila in filas if fila['name'] == 'Paciente Exportación']
+        self.assertEqual(len(del_paciente), 1)
+        self.assertEqual(del_paciente[0]['consulta_id'], str(self.consulta.id))
+        self.assertEqual(del_paciente[0]['consulta_rx_od_esfera'], '-1.25')
+        self.assertEqual(del_paciente[0]['cefalea'], '1')
+
+        sin_consultas = [fila for fila in filas if fila['name'] == 'Paciente Sin Consultas']
+        self.assertEqual(len(sin_consultas), 1)
+        self.assertEqual(sin_consultas[0]['consulta_id'], '')
+
+    def test_exportar_xlsx(self):
+        exportacion = self._exportar('xlsx')
+        self.assertEqual(exportacion.state, 'hecho', exportacion.log)
+        with open(exportacion._ruta_archivo(), 'rb') as archivo:
+            self.assertEqual(archivo.read(2), b'PK')
+        self.assertEqual(exportacion.filas, self._filas_esperadas())
+        self.assertEqual(exportacion.total_filas, exportacion.filas)